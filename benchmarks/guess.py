@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" compares the fast filename guesses with plain guessit
+
+usage: python benchmarks/guess.py [directory] [rounds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mediasort import error  # noqa: E402
+from mediasort.plugins import filename  # noqa: E402
+
+FIELDS = ['type', 'title', 'year', 'season', 'episode', 'releasegroup']
+
+
+def guess_all(filepaths, fast):
+    """ returns the guesses and the needed time """
+    filename.init({'fast': fast})
+    start = time.perf_counter()
+    guesses = []
+    for filepath in filepaths:
+        try:
+            guesses.append(filename.get_guess(filepath))
+        except error.NotEnoughData:
+            guesses.append({})
+    return guesses, time.perf_counter() - start
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), '..', 'testfiles')
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    filepaths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            filepaths.append(os.path.join(root, name))
+    filepaths.sort()
+
+    # warm up guessit
+    guess_all(filepaths[:1], False)
+
+    plain, fast = [], []
+    for _ in range(rounds):
+        guesses, duration = guess_all(filepaths, False)
+        plain.append(duration)
+        fastguesses, duration = guess_all(filepaths, True)
+        fast.append(duration)
+
+    fastpaths = 0
+    mismatches = []
+    for filepath, guess, fastguess in zip(filepaths, guesses, fastguesses):
+        if filename.get_fast_guess(os.path.basename(os.path.dirname(filepath))) or \
+           filename.get_fast_guess(os.path.splitext(os.path.basename(filepath))[0]):
+            fastpaths += 1
+        for field in FIELDS:
+            if guess.get(field) != fastguess.get(field):
+                mismatches.append((filepath, field, guess.get(field),
+                                   fastguess.get(field)))
+
+    print("files:            {0}".format(len(filepaths)))
+    print("fast path used:   {0}".format(fastpaths))
+    print("guessit:          {0:.1f} files/s".format(
+        len(filepaths) / min(plain)))
+    print("fast + fallback:  {0:.1f} files/s".format(
+        len(filepaths) / min(fast)))
+    print("differing fields: {0}".format(len(mismatches)))
+    for filepath, field, plainvalue, fastvalue in mismatches:
+        print("  {0}\n    {1}: guessit {2!r}, fast {3!r}".format(
+            os.path.relpath(filepath, directory), field, plainvalue,
+            fastvalue))
+
+
+if __name__ == '__main__':
+    main()
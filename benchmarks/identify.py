@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" counts the tmdb requests needed to identify a movie. tmdb is replaced
+by fake responses, so nothing is requested for real
+
+usage: python benchmarks/identify.py [--baseline] [candidates ...]
+
+with --baseline the requests of the flow before candidates were built from
+the search results are counted too. it loaded the details of every search
+result to offer them to the callback. the old functions aren't run, the
+baseline is a simulation which repeats their requests with the current load
+"""
+
+import os
+import sys
+
+import tmdbsimple.base
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mediasort.enums import MediaType  # noqa: E402
+from mediasort.plugins import tmdb  # noqa: E402
+
+REQUESTS = []
+
+
+def get_movie(tmdb_id):
+    """ returns a fake movie """
+    return {
+        'id': tmdb_id,
+        'title': "Movie {0}".format(tmdb_id),
+        'original_title': "Movie {0}".format(tmdb_id),
+        'release_date': "2010-01-01",
+        'overview': "",
+        'popularity': 1.0,
+        'imdb_id': "tt{0:07d}".format(tmdb_id),
+        'external_ids': {'imdb_id': "tt{0:07d}".format(tmdb_id)},
+    }
+
+
+def get_fake_request(candidates):
+    """ returns a replacement for the requests of tmdbsimple """
+
+    def request(self, method, path, params=None, payload=None):
+        REQUESTS.append(path)
+        if path.startswith('search/movie'):
+            return {'results': [get_movie(i + 1) for i in range(candidates)]}
+        if path.startswith('movie/'):
+            return get_movie(int(path.split('/')[1]))
+        raise AssertionError("Unexpected request of {0}".format(path))
+
+    return request
+
+
+def reset(candidates):
+    """ answers with given number of search results and forgets all
+    responses and requests """
+    tmdbsimple.base.TMDB._request = get_fake_request(candidates)
+    tmdb.RESPONSES.clear()
+    del REQUESTS[:]
+
+
+def identify(candidates):
+    """ returns the requests needed to identify a movie with given number
+    of search results """
+    reset(candidates)
+
+    guess = {'type': MediaType.movie, 'title': "Movie", 'year': 2010}
+    identificator = {'type': MediaType.movie, 'tmdb': None, 'imdb': None}
+    tmdb.get_identificator(guess, identificator,
+                           lambda candidates, mediatype: candidates[-1]['id'])
+    return list(REQUESTS)
+
+
+def identify_baseline(candidates):
+    """ returns the requests the flow before built candidates from the
+    search results needed. it loaded every search result. this simulates the
+    old flow with the current load instead of running the old code """
+    reset(candidates)
+
+    language = tmdb.CONFIG['search_language']
+    results = tmdb.load('search_movie', query="Movie", year=2010,
+                        language=language)['results']
+    if len(results) > 1:
+        for result in results:
+            tmdb.load_entity('movie', result['id'], language)
+    # the imdb id of the chosen movie
+    tmdb.load_entity('movie', results[-1]['id'], language)
+    return list(REQUESTS)
+
+
+def main():
+    tmdb.CONFIG['search_language'] = tmdb.get_language('en')
+    args = sys.argv[1:]
+    baseline = '--baseline' in args
+    counts = [int(arg) for arg in args if arg != '--baseline'] or [1, 5, 20]
+
+    if baseline:
+        print("baseline: simulated requests of the flow before candidates")
+        print("candidates  baseline  requests")
+    else:
+        print("candidates  requests")
+    for candidates in counts:
+        requests = len(identify(candidates))
+        if baseline:
+            print("{0:>10}  {1:>8}  {2:>8}".format(
+                candidates, len(identify_baseline(candidates)), requests))
+        else:
+            print("{0:>10}  {1:>8}".format(candidates, requests))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,9 +21,10 @@ import os
 from importlib import import_module
 
 from mediasort.enums import PluginType, MediaType
-from mediasort import error
+from mediasort import error, sorting, httpclient, download
 # stuff we need from outside
-from mediasort.sorting import sort  # noqa: F401
+from mediasort.sorting import sort, sort_many, async_sort  # noqa: F401
+from mediasort.pipeline import sort_pipeline  # noqa: F401
 
 
 def check_function(module, function):
@@ -64,6 +65,10 @@ def initialize_plugins(config):
     checks if some configurations are valid
     """
 
+    # the plugins share the connections of the http client
+    httpclient.init(config.get('http'))
+    download.init(config.get('downloads'))
+
     plugins = {
         PluginType.guess.name: [],
         PluginType.identificator.name: {},
@@ -167,4 +172,7 @@ def initialize_plugins(config):
             if mid not in ids['provided'][mediatype.name]:
                 raise error.InvalidConfig("A plugin needs a {0} id which isn't provided by the identificator providers".format(mid))
 
+    # the plan how metadata and images are resolved is built only once
+    plugins['plan'] = sorting.build_plan(plugins)
+
     return {'plugins': plugins, 'ids': ids}
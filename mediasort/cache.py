@@ -0,0 +1,357 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" persistent caches in sqlite databases """
+
+import os
+import json
+import pickle
+import sqlite3
+import threading
+import time
+
+from appdirs import user_cache_dir
+
+CACHEDIR = user_cache_dir('mediasort', 'ChrisOboe')
+
+# increase if the format of cached guesses changes
+GUESS_VERSION = 1
+
+# every thread has its own connections
+LOCAL = threading.local()
+
+
+# INTERNAL
+def get_connection(name):
+    """ returns the connection of the current thread to a cache database """
+    connections = LOCAL.__dict__.setdefault('connections', {})
+
+    if name not in connections:
+        os.makedirs(CACHEDIR, exist_ok=True)
+        connection = sqlite3.connect(
+            os.path.join(CACHEDIR, name + ".sqlite"),
+            timeout=30.0)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connections[name] = connection
+
+    return connections[name]
+
+
+def get_guess_connection():
+    """ returns the connection to the guess cache """
+    connection = get_connection('guesses')
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS guesses ("
+        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, "
+        "nfo_mtime INTEGER, version TEXT, guess BLOB)")
+    return connection
+
+
+def get_file_state(filepath):
+    """ returns size and mtime of a file and the mtime of its nfo """
+    stat = os.stat(filepath)
+    try:
+        nfo_mtime = os.stat(os.path.splitext(filepath)[0] + ".nfo").st_mtime_ns
+    except FileNotFoundError:
+        nfo_mtime = -1
+    return stat.st_size, stat.st_mtime_ns, nfo_mtime
+
+
+# GUESSES
+def get_guess_version(providers):
+    """ returns a stamp which changes when the guess providers or their
+    versions change """
+    stamp = [str(GUESS_VERSION)]
+    for provider in providers:
+        version = ''
+        if hasattr(provider, 'get_guess_version'):
+            version = provider.get_guess_version()
+        stamp.append("{0}={1}".format(provider.__name__, version))
+    return ";".join(stamp)
+
+
+def load_guess(filepath, version):
+    """ returns the cached guess of an unchanged file or None """
+    try:
+        size, mtime, nfo_mtime = get_file_state(filepath)
+    except OSError:
+        return None
+
+    row = get_guess_connection().execute(
+        "SELECT guess FROM guesses WHERE path = ? AND size = ? AND mtime = ? "
+        "AND nfo_mtime = ? AND version = ?",
+        (filepath, size, mtime, nfo_mtime, version)).fetchone()
+
+    if row is None:
+        return None
+    return pickle.loads(row[0])
+
+
+def save_guess(filepath, version, guess):
+    """ caches a guess, which can also be the error why guessing failed """
+    try:
+        size, mtime, nfo_mtime = get_file_state(filepath)
+    except OSError:
+        return
+
+    connection = get_guess_connection()
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO guesses VALUES (?, ?, ?, ?, ?, ?)",
+            (filepath, size, mtime, nfo_mtime, version, pickle.dumps(guess)))
+
+
+# PROCESSED FILES
+def get_processed_connection():
+    """ returns the connection to the index of processed files """
+    connection = get_connection('processed')
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS processed ("
+        "path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, mtime INTEGER, "
+        "outcome TEXT, timestamp REAL, attempts INTEGER)")
+    return connection
+
+
+def load_processed(filepath):
+    """ returns outcome, timestamp and attempts of the last time an unchanged
+    file was processed or None """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    row = get_processed_connection().execute(
+        "SELECT outcome, timestamp, attempts FROM processed "
+        "WHERE path = ? AND inode = ? AND size = ? AND mtime = ?",
+        (filepath, stat.st_ino, stat.st_size, stat.st_mtime_ns)).fetchone()
+
+    if row is None:
+        return None
+    return {'outcome': row[0], 'timestamp': row[1], 'attempts': row[2]}
+
+
+def save_processed(filepath, outcome):
+    """ remembers the outcome of processing a file. failed attempts of an
+    unchanged file are counted. files which are gone are forgotten """
+    connection = get_processed_connection()
+
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        with connection:
+            connection.execute("DELETE FROM processed WHERE path = ?",
+                               (filepath,))
+        return
+
+    attempts = 0
+    if outcome == 'failed':
+        last = load_processed(filepath)
+        attempts = 1
+        if last is not None and last['outcome'] == 'failed':
+            attempts += last['attempts']
+
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO processed VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (filepath, stat.st_ino, stat.st_size, stat.st_mtime_ns, outcome,
+             time.time(), attempts))
+
+
+# RESPONSES
+def get_response_connection():
+    """ returns the connection to the cache of responses of web apis """
+    connection = get_connection('responses')
+    prepared = LOCAL.__dict__.setdefault('prepared', set())
+    if 'responses' in prepared:
+        return connection
+
+    with connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, kind TEXT, created REAL, accessed REAL, "
+            "size INTEGER, response TEXT)")
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed "
+            "ON responses (accessed)")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_stats ("
+            "kind TEXT PRIMARY KEY, hits INTEGER, misses INTEGER)")
+        # the total size is kept up to date by triggers, so it never has to
+        # be summed up again
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS response_size ("
+            "id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)")
+        connection.execute(
+            "INSERT OR IGNORE INTO response_size "
+            "SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_insert "
+            "AFTER INSERT ON responses BEGIN "
+            "UPDATE response_size SET size = size + new.size; END")
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_update "
+            "AFTER UPDATE OF size ON responses BEGIN "
+            "UPDATE response_size SET size = size - old.size + new.size; END")
+        connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS responses_delete "
+            "AFTER DELETE ON responses BEGIN "
+            "UPDATE response_size SET size = size - old.size; END")
+    prepared.add('responses')
+    return connection
+
+
+def load_response(key, kind, ttl):
+    """ returns a cached response which isn't older than ttl seconds or
+    None. hits and misses are counted per kind """
+    connection = get_response_connection()
+    now = time.time()
+
+    row = connection.execute(
+        "SELECT response FROM responses WHERE key = ? AND created > ?",
+        (key, now - ttl)).fetchone()
+
+    with connection:
+        if row is not None:
+            connection.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        connection.execute(
+            "INSERT OR IGNORE INTO response_stats VALUES (?, 0, 0)", (kind,))
+        connection.execute(
+            "UPDATE response_stats SET {0} = {0} + 1 WHERE kind = ?".format(
+                'misses' if row is None else 'hits'), (kind,))
+
+    if row is None:
+        return None
+    return json.loads(row[0])
+
+
+def save_response(key, kind, response, maxsize):
+    """ caches a response. if the cache gets bigger than maxsize bytes the
+    least recently used responses are removed """
+    data = json.dumps(response)
+    now = time.time()
+
+    connection = get_response_connection()
+    with connection:
+        connection.execute(
+            "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET kind = excluded.kind, "
+            "created = excluded.created, accessed = excluded.accessed, "
+            "size = excluded.size, response = excluded.response",
+            (key, kind, now, now, len(data), data))
+
+        size = connection.execute(
+            "SELECT size FROM response_size").fetchone()[0]
+        if size <= maxsize:
+            return
+
+        removed = []
+        for oldkey, oldsize in connection.execute(
+                "SELECT key, size FROM responses ORDER BY accessed"):
+            if size <= maxsize:
+                break
+            removed.append((oldkey,))
+            size -= oldsize
+        connection.executemany("DELETE FROM responses WHERE key = ?", removed)
+
+
+def get_response_stats():
+    """ returns the hits and misses of every kind of cached responses """
+    return {kind: {'hits': hits, 'misses': misses}
+            for kind, hits, misses in get_response_connection().execute(
+                "SELECT kind, hits, misses FROM response_stats")}
+
+
+# DOWNLOADS
+def get_download_connection():
+    """ returns the connection to the journal of unfinished downloads """
+    connection = get_connection('downloads')
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS downloads ("
+        "destination TEXT PRIMARY KEY, url TEXT, temp TEXT, "
+        "received INTEGER, etag TEXT, modified TEXT, updated REAL)")
+    return connection
+
+
+def load_download(destination):
+    """ returns the unfinished download of a destination or None """
+    row = get_download_connection().execute(
+        "SELECT url, temp, received, etag, modified FROM downloads "
+        "WHERE destination = ?", (destination,)).fetchone()
+
+    if row is None:
+        return None
+    return {'url': row[0], 'temp': row[1], 'received': row[2],
+            'etag': row[3], 'modified': row[4]}
+
+
+def save_download(destination, download):
+    """ remembers how far the download of a destination got """
+    connection = get_download_connection()
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (destination, download['url'], download['temp'],
+             download['received'], download['etag'], download['modified'],
+             time.time()))
+
+
+def forget_download(destination):
+    """ forgets the download of a destination """
+    connection = get_download_connection()
+    with connection:
+        connection.execute("DELETE FROM downloads WHERE destination = ?",
+                           (destination,))
+
+
+# BLOBS
+def get_blob_connection():
+    """ returns the connection to the index of the image store """
+    connection = get_connection('blobs')
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS blobs ("
+        "url TEXT PRIMARY KEY, hash TEXT, extension TEXT, created REAL)")
+    return connection
+
+
+def load_blob(url):
+    """ returns hash and extension of the stored content of an url or None """
+    return get_blob_connection().execute(
+        "SELECT hash, extension FROM blobs WHERE url = ?",
+        (url,)).fetchone()
+
+
+def save_blob(url, digest, extension):
+    """ remembers the stored content of an url """
+    connection = get_blob_connection()
+    with connection:
+        connection.execute(
+            "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)",
+            (url, digest, extension, time.time()))
+
+
+def forget_blob(url):
+    """ forgets the stored content of an url """
+    connection = get_blob_connection()
+    with connection:
+        connection.execute("DELETE FROM blobs WHERE url = ?", (url,))
+
+
+def forget_blobs(digest):
+    """ forgets every url whose stored content has digest """
+    connection = get_blob_connection()
+    with connection:
+        connection.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
@@ -14,30 +14,523 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from urllib.request import urlopen
+import os
+import re
+import sys
+import stat
+import shutil
+import hashlib
+import logging
+import contextlib
+import collections
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, Future
 from urllib.parse import urlsplit
 
+from mediasort import error, httpclient, cache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# create logger
+logger = logging.getLogger('mediasort')
+
+# bytes read and written at once
+CHUNK_SIZE = 65536
+# bytes received between updates of the journal
+JOURNAL_SIZE = 1048576
+# ioctl which shares the data of two files on copy on write filesystems
+FICLONE = 0x40049409
+# name of a stored image, its digest and extension
+BLOB_PATTERN = re.compile(r'^([0-9a-f]{64})\.(\w+)$')
+
+CONFIG = {
+    'workers': 8,
+    'per_host': 4,
+    'resume': True,
+    # folder where images are downloaded once and linked to their paths
+    'store': None,
+}
+
 # Remebers if file is already written
 DOWNLOADED = []
+DOWNLOADED_LOCK = threading.Lock()
+
+# downloads run in a pool shared by all videofiles
+EXECUTOR = None
+# queued downloads per destination
+QUEUED = {}
+# running and waiting downloads per host
+HOSTS = {}
+QUEUE_LOCK = threading.Lock()
+
+# keys of the store locked by threads of this process
+LOCKED = set()
+LOCKED_CONDITION = threading.Condition()
+
+
+def get_temp_path(destination):
+    """ returns a hidden path next to destination, so it's on the same
+    filesystem and can be renamed atomically """
+    folder, filename = os.path.split(destination)
+    return os.path.join(folder, ".{0}.{1}.part".format(filename,
+                                                       uuid.uuid4().hex))
+
+
+def remove(path):
+    """ removes a file if it exists """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def discard(destination, partial):
+    """ removes an unfinished download """
+    remove(partial['temp'])
+    if CONFIG['resume']:
+        cache.forget_download(destination)
+
+
+def get_partial(url, destination):
+    """ returns the unfinished download of the url to destination or None.
+    unfinished downloads which can't be continued are removed """
+    if not CONFIG['resume']:
+        return None
+    partial = cache.load_download(destination)
+    if partial is None:
+        return None
+
+    try:
+        size = os.path.getsize(partial['temp'])
+    except OSError:
+        size = -1
+    if partial['url'] != url or size < partial['received'] or \
+       not partial['received'] or \
+       not (partial['etag'] or partial['modified']):
+        discard(destination, partial)
+        return None
+
+    # only what was written before the journal was updated is trusted
+    if size > partial['received']:
+        os.truncate(partial['temp'], partial['received'])
+    return partial
+
+
+def get_validator(headers):
+    """ returns the strong etag and the last modified date of a response """
+    etag = headers.get('ETag')
+    if etag is not None and etag.startswith('W/'):
+        etag = None
+    return etag, headers.get('Last-Modified')
+
+
+def get_headers(partial):
+    """ returns the headers which continue an unfinished download """
+    # ranges of compressed responses can't be continued
+    headers = {'Accept-Encoding': 'identity'}
+    if partial is not None:
+        headers['Range'] = "bytes={0}-".format(partial['received'])
+        headers['If-Range'] = partial['etag'] or partial['modified']
+    return headers
+
+
+def is_continued(remote, partial):
+    """ returns if a response continues an unfinished download """
+    if partial is None or remote.status_code != 206:
+        return False
+    match = re.match(r'bytes (\d+)-', remote.headers.get('Content-Range', ''))
+    if match is None or int(match.group(1)) != partial['received']:
+        return False
+    etag, modified = get_validator(remote.headers)
+    if partial['etag']:
+        return etag in (None, partial['etag'])
+    return modified in (None, partial['modified'])
+
+
+def write(remote, url, destination, path, partial):
+    """ streams a response into path. the file only appears at path when it
+    is complete. while downloading, the progress is written to the journal
+    so an interrupted download can be continued """
+    if partial is not None:
+        journal = dict(partial)
+        mode = 'ab'
+    else:
+        etag, modified = get_validator(remote.headers)
+        journal = {'url': url, 'temp': get_temp_path(destination),
+                   'received': 0, 'etag': etag, 'modified': modified}
+        mode = 'xb'
+    temp = journal['temp']
+    journaled = journal['received']
+    resumable = CONFIG['resume'] and (journal['etag'] or journal['modified'])
+
+    try:
+        with open(temp, mode) as local:
+            if resumable:
+                cache.save_download(destination, journal)
+            for chunk in remote.iter_content(CHUNK_SIZE):
+                local.write(chunk)
+                journal['received'] += len(chunk)
+                if resumable and journal['received'] - journaled >= \
+                   JOURNAL_SIZE:
+                    local.flush()
+                    cache.save_download(destination, journal)
+                    journaled = journal['received']
+
+        # the length is checked before the content is decoded
+        expected = remote.headers.get('Content-Length')
+        if expected is not None and remote.raw.tell() != int(expected):
+            raise error.IncompleteDownload(
+                "Got {0} of {1} bytes from {2}".format(
+                    remote.raw.tell(), expected, remote.url))
+
+        os.replace(temp, path)
+    except BaseException:
+        if resumable and journal['received']:
+            # keep what was received for the next attempt
+            cache.save_download(destination, journal)
+        else:
+            discard(destination, journal)
+        raise
+
+    if resumable:
+        cache.forget_download(destination)
+
+
+def fetch(url, destination):
+    """ downloads a file and returns its path. an unfinished download of it
+    is continued if the server still has the same file, otherwise it's
+    downloaded again """
+    partial = get_partial(url, destination)
+    try:
+        remote = httpclient.get(url, stream=True,
+                                headers=get_headers(partial))
+    except httpclient.ERRORS as e:
+        # the server doesn't have the range anymore
+        if partial is None or httpclient.get_status(e) != 416:
+            raise
+        discard(destination, partial)
+        return fetch(url, destination)
+
+    with remote:
+        if partial is not None and not is_continued(remote, partial):
+            logger.debug("Can't continue download of " + url)
+            discard(destination, partial)
+            if remote.status_code == 206:
+                return fetch(url, destination)
+            partial = None
+
+        # get filename
+        filename = None
+        if 'Content-Disposition' in remote.headers:
+            filename = remote.headers['Content-Disposition']
+        else:
+            filename = urlsplit(url)[2]
+
+        # extract extension from filename
+        extension = filename.split('.')[-1]
+
+        # download the file
+        path = "{0}.{1}".format(destination, extension)
+        write(remote, url, destination, path, partial)
+        return path
+
+
+# STORE
+@contextlib.contextmanager
+def lock_store(exclusive=False):
+    """ locks the whole store. pruning locks it exclusively, downloads share
+    the lock. raises BlockingIOError if an exclusive lock isn't available
+    right away """
+    os.makedirs(CONFIG['store'], exist_ok=True)
+    with open(os.path.join(CONFIG['store'], 'store.lock'), 'a') as lockfile:
+        if fcntl is not None:
+            if exclusive:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                fcntl.flock(lockfile, fcntl.LOCK_SH)
+        yield
+
+
+def lock_file(path):
+    """ returns an exclusively locked file at path. a file which was removed
+    by its previous holder while waiting is opened again """
+    while True:
+        lockfile = open(path, 'a')
+        fcntl.flock(lockfile, fcntl.LOCK_EX)
+        try:
+            if os.fstat(lockfile.fileno()).st_ino == os.stat(path).st_ino:
+                return lockfile
+        except FileNotFoundError:
+            pass
+        lockfile.close()
+
+
+@contextlib.contextmanager
+def lock(key):
+    """ locks a key of the store against other threads and processes. the
+    lock file is removed afterwards """
+    with LOCKED_CONDITION:
+        while key in LOCKED:
+            LOCKED_CONDITION.wait()
+        LOCKED.add(key)
+
+    try:
+        if fcntl is None:
+            yield
+            return
+
+        folder = os.path.join(CONFIG['store'], 'locks')
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, key)
+        lockfile = lock_file(path)
+        try:
+            yield
+        finally:
+            remove(path)
+            lockfile.close()
+    finally:
+        with LOCKED_CONDITION:
+            LOCKED.discard(key)
+            LOCKED_CONDITION.notify_all()
+
+
+def get_digest(path):
+    """ returns the sha256 of a file """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as local:
+        for chunk in iter(lambda: local.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_blob_path(digest, extension):
+    """ returns where content with digest is stored """
+    return os.path.join(CONFIG['store'], digest[:2],
+                        "{0}.{1}".format(digest, extension))
+
+
+def get_blob(url):
+    """ returns the stored file of an url or None """
+    blob = cache.load_blob(url)
+    if blob is None:
+        return None
+
+    path = get_blob_path(*blob)
+    if not os.path.isfile(path):
+        cache.forget_blob(url)
+        return None
+    return path
+
+
+def add_blob(url, key):
+    """ downloads an url into the store and returns the stored file. urls
+    with the same content share one file """
+    path = fetch(url, os.path.join(CONFIG['store'], key))
+    digest = get_digest(path)
+    extension = path.rsplit('.', 1)[-1]
+
+    blob = get_blob_path(digest, extension)
+    if os.path.isfile(blob):
+        # keep the file which is already linked
+        remove(path)
+    else:
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        os.replace(path, blob)
+    cache.save_blob(url, digest, extension)
+    return blob
+
+
+def reflink(source, path):
+    """ creates path sharing the data of source, if the filesystem can do
+    copy on write """
+    if fcntl is None or not sys.platform.startswith('linux'):
+        raise OSError("Reflinks aren't supported on this platform")
+    with open(source, 'rb') as src, open(path, 'xb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def place(source, path):
+    """ puts a stored file at path. a hardlink is used if possible, then a
+    reflink and otherwise a copy """
+    temp = get_temp_path(path)
+    try:
+        try:
+            os.link(source, temp)
+        except OSError:
+            try:
+                reflink(source, temp)
+            except OSError:
+                remove(temp)
+                shutil.copyfile(source, temp)
+        os.replace(temp, path)
+    except BaseException:
+        remove(temp)
+        raise
+
+
+def store(url, destination):
+    """ downloads an url only if it isn't in the store yet and puts it at
+    destination """
+    key = hashlib.sha1(url.encode()).hexdigest()
+
+    with lock_store(), lock(key):
+        blob = get_blob(url)
+        if blob is None:
+            blob = add_blob(url, key)
+        else:
+            logger.debug("Using stored " + url)
+
+        place(blob, "{0}.{1}".format(destination, blob.rsplit('.', 1)[-1]))
+
+
+def get_stored_blobs():
+    """ returns the paths and digests of the images in the store. other
+    files and folders, like the ones of unfinished downloads, are left
+    out """
+    for folder in os.listdir(CONFIG['store']):
+        path = os.path.join(CONFIG['store'], folder)
+        if not re.match(r'^[0-9a-f]{2}$', folder) or not os.path.isdir(path):
+            continue
+        for filename in os.listdir(path):
+            match = BLOB_PATTERN.match(filename)
+            if match is None or not match.group(1).startswith(folder):
+                continue
+            blob = os.path.join(path, filename)
+            if stat.S_ISREG(os.lstat(blob).st_mode):
+                yield blob, match.group(1)
+
+
+def prune_store():
+    """ removes stored images which aren't linked anywhere anymore. images
+    which had to be copied are removed too. nothing is pruned while another
+    process uses the store or if the platform can't tell """
+    if fcntl is None or not os.path.isdir(CONFIG['store']):
+        return
+
+    try:
+        with lock_store(exclusive=True):
+            removed = 0
+            for blob, digest in get_stored_blobs():
+                if os.stat(blob).st_nlink > 1:
+                    continue
+                remove(blob)
+                cache.forget_blobs(digest)
+                removed += 1
+    except BlockingIOError:
+        logger.debug("Store is in use, not pruning it")
+        return
+
+    logger.debug("Pruned {0} stored images".format(removed))
 
 
 def download(url, destination):
     """ download the file if not downloaded before """
-    if destination not in DOWNLOADED:
-        with urlopen(url, timeout=30.0) as remote:
-            # get filename
-            filename = None
-            if 'Content-Disposition' in remote.info():
-                filename = remote.info()['Content-Disposition']
-            else:
-                filename = urlsplit(url)[2]
+    with DOWNLOADED_LOCK:
+        if destination in DOWNLOADED:
+            return
+        # reserve the destination so no other thread downloads it too
+        DOWNLOADED.append(destination)
+
+    try:
+        if CONFIG['store']:
+            store(url, destination)
+        else:
+            fetch(url, destination)
+    except Exception:
+        # forget the reservation so it can be retried
+        with DOWNLOADED_LOCK:
+            DOWNLOADED.remove(destination)
+        raise
+
+
+# MANAGER
+def init(config):
+    """ sets how many downloads run at once and per host, if unfinished
+    downloads are continued and where images are stored """
+    global EXECUTOR
+    CONFIG.update(config or {})
+    if CONFIG['store']:
+        CONFIG['store'] = os.path.expanduser(CONFIG['store'])
+        prune_store()
+    with QUEUE_LOCK:
+        executor = EXECUTOR
+        EXECUTOR = None
+    # running downloads need the lock to finish
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def clear_cache():
+    """ forgets which files were downloaded, so they can be downloaded
+    again """
+    with DOWNLOADED_LOCK:
+        DOWNLOADED.clear()
+
+
+def get_executor():
+    """ returns the pool running the downloads. the queue lock has to be
+    held """
+    global EXECUTOR
+    if EXECUTOR is None:
+        EXECUTOR = ThreadPoolExecutor(max_workers=CONFIG['workers'])
+    return EXECUTOR
+
+
+def submit(host):
+    """ starts waiting downloads of a host as long as it has less than
+    per_host running. the queue lock has to be held """
+    queued = HOSTS[host]
+    while queued['waiting'] and queued['running'] < CONFIG['per_host']:
+        queued['running'] += 1
+        get_executor().submit(run, host, *queued['waiting'].popleft())
+
+
+def run(host, url, destination, future):
+    """ downloads a file for a queued future and starts the next waiting
+    download of the host """
+    try:
+        download(url, destination)
+    except BaseException as e:
+        future.set_exception(e)
+    else:
+        future.set_result(None)
+    finally:
+        with QUEUE_LOCK:
+            HOSTS[host]['running'] -= 1
+            submit(host)
+
+
+def queue(url, destination):
+    """ queues the download of a file and returns its future. a destination
+    which is already queued gets the same future. downloads of a host wait
+    in its own queue, so a busy host doesn't hold up the others """
+    host = urlsplit(url).hostname
+
+    with QUEUE_LOCK:
+        if destination in QUEUED:
+            return QUEUED[destination]
+        future = Future()
+        QUEUED[destination] = future
+        if host not in HOSTS:
+            HOSTS[host] = {'running': 0, 'waiting': collections.deque()}
+        HOSTS[host]['waiting'].append((url, destination, future))
+        submit(host)
 
-            # extract extension from filename
-            extension = filename.split('.')[-1]
+    def forget(future):
+        with QUEUE_LOCK:
+            QUEUED.pop(destination, None)
+    future.add_done_callback(forget)
+    return future
 
-            # download the file
-            with open("{0}.{1}".format(destination, extension), 'wb') as local:
-                local.write(remote.read())
 
-            # remember it
-            DOWNLOADED.append(destination)
+def wait(futures):
+    """ waits until all queued downloads are done and raises the error of
+    the first failed one """
+    errors = [future.exception() for future in futures]
+    for e in errors:
+        if e is not None:
+            raise e
@@ -43,3 +43,13 @@ class InvalidMediaType(Exception):
 class CallbackBreak(Exception):
     """ Should be raised when the callback function should stop something """
     pass
+
+
+class IncompleteDownload(Exception):
+    """ Should be raised when a download got less data than announced """
+    pass
+
+
+class GuessError(Exception):
+    """ Should be raised when guessing a filename failed unexpectedly """
+    pass
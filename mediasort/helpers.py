@@ -18,12 +18,19 @@
 
 from urllib.request import urlretrieve
 from urllib.parse import urlparse
+from fnmatch import fnmatch
 import logging
 import os
+import queue
 import shutil
+import threading
 
 DOWNLOADED = []
 
+# folders which never contain media worth sorting
+PRUNE = ['sample', 'samples', '.@__thumb', '@eadir', '.appledouble',
+         '.trash*', '$recycle.bin', 'lost+found']
+
 
 def merge_dict(base_dict, overwrite_dict):
     """ appends missing informations to base_dict """
@@ -125,27 +132,180 @@ def move(src, dst, simulate=False, overwrite=False, append_ext=True):
         shutil.move(src, dst)
 
 
-def find(path, extensions, filesize):
+def is_pruned(name, prune):
+    """ returns if a folder name matches a prune rule """
+    name = name.lower()
+    for rule in prune:
+        if fnmatch(name, rule):
+            return True
+    return False
+
+
+def scan_folder(folder, extensions, minsize, prune):
+    """ returns the matching files and the not pruned subfolders of a
+    folder. minsize is in bytes """
+    files = []
+    subfolders = []
+
+    try:
+        entries = os.scandir(folder)
+    except OSError:
+        return files, subfolders
+
+    with entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if not is_pruned(entry.name, prune):
+                        subfolders.append(entry.path)
+                    continue
+                ext = os.path.splitext(entry.name)[1].lower()[1:]
+                if ext in extensions and entry.stat().st_size >= minsize:
+                    files.append(entry.path)
+            except OSError:
+                continue
+
+    return files, subfolders
+
+
+def scan(path, extensions, filesize, prune=None):
+    """ yields all files with given extensions and bigger than filesize in
+    path as soon as they are found. folders matching a rule in prune are
+    skipped """
+
+    filesize *= 1048576  # use filesize as MB
+    if prune is None:
+        prune = PRUNE
+
+    try:
+        if not os.path.isdir(path):
+            ext = os.path.splitext(path)[1].lower()[1:]
+            if ext in extensions and os.path.getsize(path) >= filesize:
+                yield path
+            return
+    except OSError:
+        return
+
+    folders = [path]
+    while folders:
+        files, subfolders = scan_folder(folders.pop(), extensions, filesize,
+                                        prune)
+        yield from files
+        # visit the subfolders in order
+        folders.extend(reversed(subfolders))
+
+
+def scan_device(roots, extensions, minsize, prune, workers, found, stop):
+    """ scans the roots on one device with multiple threads. every thread
+    takes the next folder, so big subtrees are spread over all threads """
+    folders = queue.Queue()
+    pending = {'count': len(roots)}
+    done = threading.Condition()
+    for root in roots:
+        folders.put(root)
+
+    def worker():
+        while True:
+            folder = folders.get()
+            if folder is None or stop.is_set():
+                return
+            files, subfolders = scan_folder(folder, extensions, minsize, prune)
+            with done:
+                pending['count'] += len(subfolders) - 1
+                done.notify_all()
+            for subfolder in subfolders:
+                folders.put(subfolder)
+            for filepath in files:
+                put(found, filepath, stop)
+
+    threads = [threading.Thread(target=worker, daemon=True)
+               for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    # wait until every folder is scanned, then stop the threads
+    with done:
+        while pending['count'] and not stop.is_set():
+            done.wait(0.1)
+    for _ in threads:
+        folders.put(None)
+    put(found, None, stop)
+
+
+def put(target, item, stop):
+    """ puts an item into a queue until it succeeds or stop is set """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            pass
+
+
+def get_roots(roots):
+    """ returns the roots without the ones which are the same as or inside
+    another root, so no file is scanned twice """
+    reals = {}
+    for root in roots:
+        reals.setdefault(os.path.realpath(root), root)
+
+    def is_inside(real, other):
+        return real != other and os.path.commonpath([real, other]) == other
+
+    return [root for real, root in reals.items()
+            if not any(is_inside(real, other) for other in reals)]
+
+
+def scan_many(roots, extensions, filesize, prune=None, workers=4):
+    """ yields all files with given extensions and bigger than filesize in
+    multiple roots. roots on different devices are scanned at the same time,
+    so a slow device doesn't hold up the others. every device is scanned
+    by workers threads. roots inside other roots are left out """
+
+    minsize = filesize * 1048576  # use filesize as MB
+    if prune is None:
+        prune = PRUNE
+
+    devices = {}
+    for root in get_roots(roots):
+        try:
+            if not os.path.isdir(root):
+                yield from scan(root, extensions, filesize, prune)
+                continue
+            devices.setdefault(os.stat(root).st_dev, []).append(root)
+        except OSError:
+            continue
+
+    found = queue.Queue(maxsize=1024)
+    stop = threading.Event()
+    for device in devices:
+        threading.Thread(target=scan_device,
+                         args=(devices[device], extensions, minsize, prune,
+                               workers, found, stop),
+                         name="mediasort-scan-{0}".format(device),
+                         daemon=True).start()
+
+    running = len(devices)
+    try:
+        while running:
+            filepath = found.get()
+            if filepath is None:
+                running -= 1
+            else:
+                yield filepath
+    finally:
+        stop.set()
+
+
+def find(path, extensions, filesize, prune=None):
     """ returns all files with given extensions
     and bigger than filesize in path """
 
-    filesize *= 1048576  # use filesize as MB
     if not os.path.exists(path):
         return
 
-    video_files = []
-    if os.path.isfile(path):
-        ext = os.path.splitext(path)[1].lower()[1:]
-        if ext in extensions and os.path.getsize(path) >= filesize:
-            video_files.append(path)
-    else:
-        for root, dirs, files in os.walk(path):
-            for filename in files:
-                filepath = os.path.join(root, filename)
-                ext = os.path.splitext(filename)[1].lower()[1:]
-                if (ext not in extensions) or \
-                   (os.path.getsize(filepath) < filesize):
-                    continue
-                video_files.append(filepath)
+    # unlike scan, find doesn't skip any folder unless told so
+    if prune is None:
+        prune = []
 
-    return video_files
+    return list(scan(path, extensions, filesize, prune))
@@ -0,0 +1,392 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" http requests shared by the plugins. connections are kept alive in a
+pool per host and every request waits for a token of its host, so the
+limits of the apis aren't exceeded """
+
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# create logger
+logger = logging.getLogger('mediasort')
+
+TIMEOUT = 30.0
+
+CONFIG = {
+    'pool_connections': 10,
+    'pool_maxsize': 16,
+    'timeout': TIMEOUT,
+    'retries': 3,
+    # requests per second and burst per host
+    'limits': {
+        'api.themoviedb.org': [4, 40],
+        'webservice.fanart.tv': [2, 10],
+    },
+    'backoff': 1.0,
+}
+
+# requests for identification go before metadata and metadata before images
+IDENTIFICATION = 0
+METADATA = 1
+IMAGES = 2
+PRIORITY = contextvars.ContextVar('priority', default=METADATA)
+
+# statuses of a throttling server, which are retried after waiting
+THROTTLED = (429, 503)
+
+# errors which can happen while requesting something
+ERRORS = (requests.RequestException, urllib.error.HTTPError,
+          urllib.error.URLError, ConnectionResetError, asyncio.TimeoutError)
+if aiohttp is not None:
+    ERRORS += (aiohttp.ClientError,)
+
+# the session used by all threads
+SESSION = None
+SESSION_LOCK = threading.Lock()
+# one aiohttp session per event loop
+SESSIONS = {}
+# requests which are in flight, so the same url is only requested once
+REQUESTS = {}
+# the token bucket of every host
+BUCKETS = {}
+BUCKETS_LOCK = threading.Lock()
+TICKETS = itertools.count()
+
+
+class KeepAliveSession(requests.Session):
+    """ a session which keeps its connections alive even if a client asks
+    to close them, like tmdbsimple does """
+
+    def request(self, method, url, headers=None, **kwargs):
+        if headers:
+            headers = {key: value for key, value in headers.items()
+                       if key.lower() != 'connection'}
+
+        host = urllib.parse.urlsplit(url).hostname
+        for attempt in itertools.count():
+            acquire(host)
+            response = super().request(method, url, headers=headers,
+                                       **kwargs)
+            if response.status_code not in THROTTLED or \
+               attempt >= CONFIG['retries']:
+                return response
+            throttle(host, get_delay(response.headers, attempt))
+            response.close()
+
+
+# SCHEDULING
+@contextlib.contextmanager
+def priority(level):
+    """ requests made inside the context get the priority level """
+    token = PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        PRIORITY.reset(token)
+
+
+def get_bucket(host):
+    """ returns the token bucket of a host. hosts without limit get tokens
+    without waiting, but still wait if the server throttles """
+    with BUCKETS_LOCK:
+        if host not in BUCKETS:
+            rate, burst = CONFIG['limits'].get(host) or (None, None)
+            BUCKETS[host] = {
+                'condition': threading.Condition(),
+                'rate': rate,
+                'burst': burst,
+                'tokens': burst,
+                'updated': time.monotonic(),
+                'blocked': 0.0,
+                'waiting': [],
+            }
+        return BUCKETS[host]
+
+
+def take(bucket, ticket):
+    """ takes a token for a waiting ticket. returns 0 if it got one and the
+    seconds to wait otherwise. only the ticket with the highest priority
+    gets a token. the condition of the bucket has to be held """
+    now = time.monotonic()
+    if bucket['rate'] is not None:
+        bucket['tokens'] = min(bucket['burst'], bucket['tokens'] +
+                               (now - bucket['updated']) * bucket['rate'])
+    bucket['updated'] = now
+
+    delay = bucket['blocked'] - now
+    if bucket['waiting'][0] is not ticket:
+        return max(delay, 0.01)
+    if bucket['rate'] is not None and bucket['tokens'] < 1:
+        delay = max(delay, (1 - bucket['tokens']) / bucket['rate'])
+    if delay > 0:
+        return delay
+
+    heapq.heappop(bucket['waiting'])
+    if bucket['rate'] is not None:
+        bucket['tokens'] -= 1
+    bucket['condition'].notify_all()
+    return 0
+
+
+def enqueue(bucket):
+    """ returns a ticket which waits in the queue of a bucket """
+    ticket = [PRIORITY.get(), next(TICKETS)]
+    heapq.heappush(bucket['waiting'], ticket)
+    return ticket
+
+
+def dequeue(bucket, ticket):
+    """ removes a ticket which stopped waiting without a token """
+    if ticket in bucket['waiting']:
+        bucket['waiting'].remove(ticket)
+        heapq.heapify(bucket['waiting'])
+        bucket['condition'].notify_all()
+
+
+def acquire(host):
+    """ waits until a request to host may be made """
+    bucket = get_bucket(host)
+    with bucket['condition']:
+        ticket = enqueue(bucket)
+        try:
+            delay = take(bucket, ticket)
+            while delay:
+                bucket['condition'].wait(delay)
+                delay = take(bucket, ticket)
+        except BaseException:
+            dequeue(bucket, ticket)
+            raise
+
+
+async def acquire_async(host):
+    """ waits until a request to host may be made without blocking """
+    bucket = get_bucket(host)
+    with bucket['condition']:
+        ticket = enqueue(bucket)
+    try:
+        while True:
+            with bucket['condition']:
+                delay = take(bucket, ticket)
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+    except BaseException:
+        with bucket['condition']:
+            dequeue(bucket, ticket)
+        raise
+
+
+def get_delay(headers, attempt):
+    """ returns the seconds to wait before a throttled request is made
+    again. Retry-After is used if the server sent it, otherwise the
+    backoff doubles every attempt """
+    retry = headers.get('Retry-After')
+    if retry is not None:
+        try:
+            return max(float(retry), 0.0)
+        except ValueError:
+            try:
+                date = email.utils.parsedate_to_datetime(retry)
+                return max(date.timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return CONFIG['backoff'] * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+def throttle(host, delay):
+    """ stops all requests to host for delay seconds """
+    logger.info("{0} is throttled, waiting {1:.1f}s".format(host, delay))
+    bucket = get_bucket(host)
+    with bucket['condition']:
+        bucket['blocked'] = max(bucket['blocked'], time.monotonic() + delay)
+        # the tokens were used up on the server side
+        if bucket['rate'] is not None:
+            bucket['tokens'] = 0.0
+        bucket['condition'].notify_all()
+
+
+def get_status(exception):
+    """ returns the http status of a failed request or None if it didn't
+    get an answer """
+    if isinstance(exception, requests.HTTPError) and \
+       exception.response is not None:
+        return exception.response.status_code
+    if isinstance(exception, urllib.error.HTTPError):
+        return exception.code
+    if aiohttp is not None and \
+       isinstance(exception, aiohttp.ClientResponseError):
+        return exception.status
+    return None
+
+
+# MODULE
+def init(config):
+    """ sets the sizes of the pools, the timeout, the retries and the limits
+    of the hosts. an existing session is kept, so everybody holding it
+    uses the new settings """
+    CONFIG.update(config or {})
+    with SESSION_LOCK:
+        if SESSION is not None:
+            mount(SESSION)
+    with BUCKETS_LOCK:
+        BUCKETS.clear()
+
+
+def mount(session):
+    """ gives a session a pool with the configured sizes and retries """
+    replaced = set(session.adapters.values())
+    retries = Retry(total=CONFIG['retries'],
+                    backoff_factor=0.5,
+                    status_forcelist=(500, 502, 504),
+                    allowed_methods=frozenset(['GET', 'HEAD']),
+                    raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=CONFIG['pool_connections'],
+                          pool_maxsize=CONFIG['pool_maxsize'],
+                          max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    # requests in flight still finish, only idle connections are closed
+    for old in replaced:
+        old.close()
+
+
+def get_session():
+    """ returns the session shared by all threads """
+    global SESSION
+    with SESSION_LOCK:
+        if SESSION is None:
+            SESSION = KeepAliveSession()
+            mount(SESSION)
+        return SESSION
+
+
+def get_stats():
+    """ returns how many requests every host got over how many connections,
+    the rest reused a connection """
+    stats = {}
+    session = SESSION
+    if session is None:
+        return stats
+
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = "{0}://{1}:{2}".format(pool.scheme, pool.host, pool.port)
+            hoststats = stats.setdefault(host, {'requests': 0,
+                                                'connections': 0})
+            hoststats['requests'] += pool.num_requests
+            hoststats['connections'] += pool.num_connections
+    return stats
+
+
+def get_url(url, params=None):
+    """ returns the url with the params as query """
+    query = sorted((key, str(value)) for key, value in (params or {}).items()
+                   if value is not None)
+    if not query:
+        return url
+    return url + "?" + urllib.parse.urlencode(query)
+
+
+def get(url, params=None, stream=False, headers=None):
+    """ requests an url with the shared session and raises on http errors.
+    a streamed response has to be closed """
+    response = get_session().get(get_url(url, params),
+                                 timeout=CONFIG['timeout'],
+                                 stream=stream,
+                                 headers=headers)
+    try:
+        response.raise_for_status()
+    except requests.HTTPError:
+        response.close()
+        raise
+    return response
+
+
+def get_json(url, params=None):
+    """ requests json """
+    return get(url, params).json()
+
+
+async def request_json(url):
+    """ requests json without blocking the event loop """
+    loop = asyncio.get_event_loop()
+
+    if aiohttp is None:
+        # the thread has to know the priority of the request
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, context.run, get_json, url)
+
+    if loop not in SESSIONS:
+        SESSIONS[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=CONFIG['pool_maxsize']),
+            timeout=aiohttp.ClientTimeout(total=CONFIG['timeout']))
+
+    host = urllib.parse.urlsplit(url).hostname
+    for attempt in itertools.count():
+        await acquire_async(host)
+        async with SESSIONS[loop].get(url) as response:
+            if response.status not in THROTTLED or \
+               attempt >= CONFIG['retries']:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+            delay = get_delay(response.headers, attempt)
+        throttle(host, delay)
+
+
+async def get_json_async(url, params=None):
+    """ requests json asynchronously. concurrent requests of the same url
+    share one request """
+    url = get_url(url, params)
+    loop = asyncio.get_event_loop()
+    key = (loop, url)
+
+    if key not in REQUESTS:
+        REQUESTS[key] = asyncio.ensure_future(request_json(url))
+        REQUESTS[key].add_done_callback(lambda _: REQUESTS.pop(key, None))
+
+    return await asyncio.shield(REQUESTS[key])
+
+
+async def close_async():
+    """ closes the aiohttp session of the running event loop """
+    session = SESSIONS.pop(asyncio.get_event_loop(), None)
+    if session is not None:
+        await session.close()
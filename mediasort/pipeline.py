@@ -0,0 +1,235 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" sorts videofiles in a pipeline of stages connected by bounded queues """
+
+import logging
+import queue
+import threading
+
+from mediasort.enums import PluginType
+from mediasort import sorting, download
+
+# create logger
+logger = logging.getLogger('mediasort')
+
+# how many threads every stage uses by default
+WORKERS = {
+    'guess': 2,
+    'identificator': 4,
+    'fetch': 8,
+    'download': 8,
+    'write': 1,
+}
+
+# marks the end of the input of a stage
+END = object()
+
+
+# stages
+def stage_guess(job, context):
+    """ guesses the videofile """
+    job['guess'] = sorting.get_guess(
+        job['videofile']['abspath'],
+        context['plugins'][PluginType.guess.name],
+        sorting.use_guess_cache(context['settings'])
+    )
+
+
+def stage_identificator(job, context):
+    """ identifies the guessed videofile """
+    job['identificator'] = sorting.get_grouped_identificator(
+        job['guess'],
+        context['plugins'][PluginType.identificator.name],
+        context['ids'],
+        context['callbacks'].get('identificator'),
+        context['groups']
+    )
+
+
+def stage_fetch(job, context):
+    """ gets metadata, paths and image urls """
+    job['entries'] = sorting.get_entries(job['guess'],
+                                         job['identificator'],
+                                         context['plugins'],
+                                         context['paths'],
+                                         context['languages'],
+                                         context['successors'])
+
+
+def stage_download(job, context):
+    """ downloads the images """
+    futures = []
+    for entry in job['entries']:
+        futures.extend(sorting.queue_entry(entry, context['settings']))
+    download.wait(futures)
+
+
+def stage_write(job, context):
+    """ writes the nfos and moves the media """
+    for entry in job['entries']:
+        sorting.write_entry(entry, context['settings'])
+    sorting.move_media(job['videofile'], job['entries'][0],
+                       context['settings'])
+    job['result']['success'] = True
+    sorting.finish_successors(context['successors'], job['entries'], True)
+
+
+STAGES = [
+    ('guess', stage_guess),
+    ('identificator', stage_identificator),
+    ('fetch', stage_fetch),
+    ('download', stage_download),
+    ('write', stage_write),
+]
+
+
+# queue helpers
+def put(target, item, stop):
+    """ puts an item into a queue until it succeeds or the pipeline stops """
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get(source, stop):
+    """ gets an item from a queue until it succeeds or the pipeline stops """
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            pass
+    return END
+
+
+def run_stage(name, function, source, target, workers, context, stop):
+    """ starts the threads of a stage. every thread puts the end marker back
+    for its siblings, the last one which finishes passes it to the next
+    stage """
+
+    running = {'count': workers}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            job = get(source, stop)
+            if job is END:
+                put(source, END, stop)
+                break
+
+            if job['result']['error'] is None and \
+               not job['result']['skipped']:
+                try:
+                    function(job, context)
+                except sorting.SORT_ERRORS as e:
+                    sorting.failed(job['result'], e)
+                except Exception as e:
+                    logger.exception("Sorting \"{0}\" failed in {1}".format(
+                        job['videofile']['abspath'], name))
+                    job['result']['error'] = e
+                if job['result']['error'] is not None:
+                    sorting.finish_successors(context['successors'],
+                                              job.get('entries', []), False)
+
+            if not put(target, job, stop):
+                break
+
+        with lock:
+            running['count'] -= 1
+            if running['count'] == 0:
+                put(target, END, stop)
+
+    threads = []
+    for _ in range(workers):
+        thread = threading.Thread(target=worker,
+                                  name="mediasort-{0}".format(name),
+                                  daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+def feed(videofiles, target, settings, stop):
+    """ puts the videofiles into the first queue """
+    for videofile in videofiles:
+        videofile = sorting.get_videofile(videofile)
+        job = {
+            'videofile': videofile,
+            'result': sorting.get_result(videofile['abspath']),
+        }
+        if not sorting.skip_processed(job['result'], settings):
+            logger.info("Processing \"{0}\"".format(videofile['abspath']))
+        if not put(target, job, stop):
+            return
+    put(target, END, stop)
+
+
+# sorting
+def sort_pipeline(videofiles, plugins, ids, paths, languages, settings,
+                  callbacks=None, workers=None, queuesize=16):
+    """ sorts videofiles in a pipeline where every stage runs in its own
+    threads. yields a result for every videofile as soon as it's done,
+    so the results can be in a different order than the videofiles """
+
+    if callbacks:
+        callbacks = sorting.serialize_callbacks(callbacks)
+    else:
+        callbacks = {}
+
+    stageworkers = dict(WORKERS)
+    if workers:
+        stageworkers.update(workers)
+
+    context = {
+        'plugins': plugins,
+        'ids': ids,
+        'paths': paths,
+        'languages': languages,
+        'settings': settings,
+        'callbacks': callbacks,
+        'successors': sorting.get_successor_registry(),
+        'groups': sorting.get_group_registry(),
+    }
+
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queuesize) for _ in range(len(STAGES) + 1)]
+
+    feeder = threading.Thread(target=feed,
+                              args=(iter(videofiles), queues[0], settings,
+                                    stop),
+                              name="mediasort-feed",
+                              daemon=True)
+
+    for i, (name, function) in enumerate(STAGES):
+        run_stage(name, function, queues[i], queues[i + 1],
+                  stageworkers[name], context, stop)
+    feeder.start()
+
+    try:
+        while True:
+            job = queues[-1].get()
+            if job is END:
+                break
+            sorting.remember_result(job['result'], settings)
+            if job['result']['success']:
+                logger.debug("---- Cut here ----\n")
+            yield job['result']
+    finally:
+        stop.set()
@@ -16,11 +16,13 @@
 
 """ provides an interface for fanart.tv """
 
-import urllib
-import json
+import logging
 
 from mediasort.enums import MediaType
-from mediasort import error
+from mediasort import error, httpclient
+
+# create logger
+logger = logging.getLogger('mediasort')
 
 FANARTTV_BASE_URL = "http://webservice.fanart.tv/v3"
 
@@ -51,22 +53,65 @@ def get_images(_id, category):
     if _id in CACHE:
         return CACHE[_id]
 
-    request = urllib.request.Request(
-        FANARTTV_BASE_URL + "/"
-        + category + "/"
-        + str(_id)
-        + "?api_key=" + CONFIG['key'])
+    try:
+        CACHE[_id] = httpclient.get_json(
+            FANARTTV_BASE_URL + "/" + category + "/" + str(_id),
+            {'api_key': CONFIG['key']})
+    except httpclient.ERRORS as e:
+        return get_no_images(_id, e)
+
+    return CACHE[_id]
+
+
+async def get_images_async(_id, category):
+    """ gets the answer from fanart.tv without blocking and caches it """
+
+    if _id in CACHE:
+        return CACHE[_id]
 
     try:
-        response = urllib.request.urlopen(request)
-        CACHE[_id] = json.loads(
-            response.read().decode(response.headers.get_content_charset()))
-    except (urllib.error.HTTPError, urllib.error.URLError, ConnectionResetError):
-        CACHE[_id] = []
+        CACHE[_id] = await httpclient.get_json_async(
+            FANARTTV_BASE_URL + "/" + category + "/" + str(_id),
+            {'api_key': CONFIG['key']})
+    except httpclient.ERRORS as e:
+        return get_no_images(_id, e)
 
     return CACHE[_id]
 
 
+def get_no_images(_id, exception):
+    """ returns no images for a failed request. only a missing id is cached,
+    other errors can go away and are asked again next time """
+    if httpclient.get_status(exception) == 404:
+        CACHE[_id] = []
+        return CACHE[_id]
+    logger.warning("Can't get images from fanart.tv: {0}".format(exception))
+    return []
+
+
+def select_image(images, fanarttypes, language):
+    """ returns the url of the first image of the fanart.tv types in the
+    answer of fanart.tv which has the language or none """
+    for fanarttype in fanarttypes:
+        if fanarttype in images:
+            for image in images[fanarttype]:
+                if image['lang'] == language or image['lang'] == "00":
+                    return image['url']
+
+    return None
+
+
+def get_source(identificator):
+    """ returns the fanart.tv imagetypes, category and id of a mediatype """
+
+    if identificator['type'] == MediaType.movie:
+        return MOVIE_IMAGE_TYPES, 'movies', identificator['tmdb']
+    elif identificator['type'] == MediaType.tvshow:
+        return TVSHOW_IMAGE_TYPES, 'tv', identificator['tvdb']
+    else:
+        raise error.InvalidMediaType
+
+
 # MODULE
 def init(fanarttvconfig):
     """ sets the fanart.tv api key """
@@ -74,6 +119,11 @@ def init(fanarttvconfig):
     CONFIG['key'] = fanarttvconfig['api_key']
 
 
+def clear_cache():
+    """ forgets the answers of fanart.tv """
+    CACHE.clear()
+
+
 def get_needed_ids(mediatype):
     if mediatype == MediaType.movie.name:
         return ['tmdb']
@@ -87,26 +137,32 @@ def get_needed_ids(mediatype):
 def get_image(identificator, imagetype, language):
     """ returns the url of an specified image """
 
-    imagetypes = None
-    category = None
-    _id = None
+    imagetypes, category, _id = get_source(identificator)
+    return select_image(get_images(_id, category), imagetypes[imagetype],
+                        language)
 
-    if identificator['type'] == MediaType.movie:
-        imagetypes = MOVIE_IMAGE_TYPES
-        category = 'movies'
-        _id = identificator['tmdb']
-    elif identificator['type'] == MediaType.tvshow:
-        imagetypes = TVSHOW_IMAGE_TYPES
-        category = 'tv'
-        _id = identificator['tvdb']
-    else:
-        raise error.InvalidMediaType
 
-    for fanarttype in imagetypes[imagetype]:
-        images = get_images(_id, category)
-        if fanarttype in images:
-            for image in images[fanarttype]:
-                if image['lang'] == language or image['lang'] == "00":
-                    return image['url']
+def get_images_bulk(identificator, imagetypes, language):
+    """ returns the urls of multiple images at once """
 
-    return None
+    fanarttypes, category, _id = get_source(identificator)
+    images = get_images(_id, category)
+    return {imagetype: select_image(images, fanarttypes[imagetype], language)
+            for imagetype in imagetypes}
+
+
+async def get_image_async(identificator, imagetype, language):
+    """ returns the url of an specified image without blocking """
+
+    imagetypes, category, _id = get_source(identificator)
+    return select_image(await get_images_async(_id, category),
+                        imagetypes[imagetype], language)
+
+
+async def get_images_bulk_async(identificator, imagetypes, language):
+    """ returns the urls of multiple images at once without blocking """
+
+    fanarttypes, category, _id = get_source(identificator)
+    images = await get_images_async(_id, category)
+    return {imagetype: select_image(images, fanarttypes[imagetype], language)
+            for imagetype in imagetypes}
@@ -16,10 +16,15 @@
 
 """ provides guesses from filename """
 
+import os
+import re
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 
-from guessit import guessit
+from guessit import guessit, __version__ as guessit_version
 
 from mediasort import error
 from mediasort.enums import MediaType
@@ -27,9 +32,136 @@ from mediasort.enums import MediaType
 # create logger
 logger = logging.getLogger('mediasort')
 
+CONFIG = {}
+
+# processes which guess filenames in batches
+POOL = None
+
+# increase if the fast guesses change
+FAST_VERSION = 3
+
+# scene release names like Title.S04E01.Episode.Title.GERMAN.1080p-GROUP
+# and Title.2007.German.DTS.1080p.BluRay.x264-GROUP
+EPISODE_PATTERN = re.compile(
+    r"^(?P<title>.+?)[._ ]S(?P<season>\d{1,2})E(?P<episode>\d{2,3})"
+    r"(?:E\d{2,3})*(?:[._ -]|$)", re.IGNORECASE)
+MOVIE_PATTERN = re.compile(
+    r"^(?P<title>.+?)[._ ]\(?(?P<year>(?:19|20)\d{2})\)?(?:[._ -]|$)")
+GROUP_PATTERN = re.compile(r"-(?P<group>[A-Za-z0-9]+)$")
+# stuff appended to release names by indexers
+JUNK_PATTERN = re.compile(r"\{\{.*?\}\}|\[.*?\]")
+YEAR_PATTERN = re.compile(r"^(?:19|20)\d{2}$")
+
+# tags which are never part of a title
+TAGS = {
+    'german', 'english', 'dl', 'dubbed', 'subbed', 'multi',
+    '480p', '576p', '720p', '1080p', '2160p',
+    'bluray', 'bdrip', 'brrip', 'dvdrip', 'webhd', 'webrip', 'web', 'hdtv',
+    'x264', 'x265', 'h264', 'h265', 'xvid', 'dts', 'ac3', 'ac3d', 'aac',
+    'uncut', 'proper', 'repack', 'rerip', 'internal', 'complete',
+}
+
+# words guessit reads as parts of a release instead of the title
+PARTS = {'vol', 'volume', 'part', 'pt', 'cd', 'disc', 'disk'}
+
+# words guessit reads as the edition or the country instead of the title
+EDITIONS = {
+    'extended', 'directors', 'dc', 'cut', 'unrated', 'uncensored',
+    'remastered', 'theatrical', 'special', 'limited', 'collectors',
+    'ultimate', 'criterion', 'imax', 'edition', '3d',
+}
+COUNTRIES = {'us', 'uk', 'gb', 'au', 'ca', 'nz'}
+
+
+# INTERNAL
+def init_worker(config):
+    """ initializes a worker process, so guessit has built its rules before
+    the first filename arrives """
+    init(config)
+    guessit("Warmup.2016.1080p.BluRay.x264-GROUP.mkv")
+
+
+def get_guess_or_error(filepath):
+    """ returns the guess or the error if the filename couldn't be guessed,
+    so one file can't fail the others of its batch """
+    try:
+        return get_guess(filepath)
+    except error.NotEnoughData as e:
+        return e
+    except Exception as e:
+        logger.exception("Guessing \"{0}\" failed".format(filepath))
+        # the error has to get back from the worker process
+        return error.GuessError("Guessing failed: {0!r}".format(e))
+
+
+def get_pool():
+    """ returns the process pool and starts it if needed. the workers are
+    started by a forkserver, since forking a process which already runs
+    threads can copy locks other threads hold """
+    global POOL
+    if POOL is None:
+        POOL = ProcessPoolExecutor(
+            max_workers=CONFIG['processes'],
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=init_worker,
+            initargs=(dict(CONFIG),))
+    return POOL
+
+
+def is_ambiguous(word):
+    """ returns if guessit may read a word of a title as something else """
+    word = word.lower()
+    return word in TAGS or word in PARTS or word in EDITIONS or \
+        word in COUNTRIES or YEAR_PATTERN.match(word) is not None
+
+
+def get_fast_guess(name):
+    """ returns a guess for a scene release name or None if the name doesn't
+    follow the conventions close enough """
+
+    # guessit keeps the junk in the release group
+    if JUNK_PATTERN.search(name):
+        return None
+
+    group = GROUP_PATTERN.search(name)
+    if group is None:
+        return None
+
+    guess = {'releasegroup': group.group('group')}
+
+    match = EPISODE_PATTERN.match(name)
+    if match is not None:
+        guess['type'] = MediaType.episode
+        guess['season'] = int(match.group('season'))
+        guess['episode'] = int(match.group('episode'))
+    else:
+        match = MOVIE_PATTERN.match(name)
+        if match is None:
+            return None
+        # another year after the year, e.g. Blade.Runner.2049.2017
+        rest = re.split(r"[._ -]", name[match.end():], maxsplit=1)[0]
+        if YEAR_PATTERN.match(rest):
+            return None
+        guess['type'] = MediaType.movie
+        guess['year'] = datetime.strptime(match.group('year'), "%Y")
+
+    # guessit reads these words as something else than the title
+    words = re.split(r"[._ ]+", match.group('title'))
+    if not all(words) or any(is_ambiguous(word) for word in words):
+        return None
+    guess['title'] = " ".join(words)
 
+    return guess
+
+
+# MODULE
 def init(config):
-    pass
+    """ sets how filenames are guessed """
+    if config is None:
+        config = {}
+    CONFIG['fast'] = config.get('fast', False)
+    CONFIG['processes'] = config.get('processes')
+    CONFIG['chunksize'] = config.get('chunksize', 32)
 
 
 def get_guess(filepath):
@@ -39,6 +171,16 @@ def get_guess(filepath):
         'filepath': filepath,
     }
 
+    # try the release name of the folder first, then the filename
+    if CONFIG.get('fast'):
+        for name in (os.path.basename(os.path.dirname(filepath)),
+                     os.path.splitext(os.path.basename(filepath))[0]):
+            fastguess = get_fast_guess(name)
+            if fastguess is not None:
+                logger.debug("Guessed title: {0}".format(fastguess['title']))
+                guess.update(fastguess)
+                return guess
+
     nameguess = guessit(filepath)
 
     if "title" in nameguess:
@@ -71,3 +213,28 @@ def get_guess(filepath):
         guess["releasegroup"] = nameguess["release_group"]
 
     return guess
+
+
+def get_guess_version():
+    """ returns the version of guessit, since its guesses depend on it """
+    if CONFIG.get('fast'):
+        return "{0}+fast{1}".format(guessit_version, FAST_VERSION)
+    return guessit_version
+
+
+def get_guesses(filepaths):
+    """ returns guesses for many filenames. guessit runs in a process pool,
+    since it needs the cpu and holds the GIL """
+
+    filepaths = list(filepaths)
+    if len(filepaths) < 2:
+        return [get_guess_or_error(filepath) for filepath in filepaths]
+
+    global POOL
+    try:
+        return list(get_pool().map(get_guess_or_error, filepaths,
+                                   chunksize=CONFIG['chunksize']))
+    except BrokenProcessPool:
+        # the next batch gets a new pool
+        POOL = None
+        raise
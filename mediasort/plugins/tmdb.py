@@ -17,27 +17,230 @@
 """ helper functions for tmdbsimple """
 
 import os
+import copy
 import datetime
 import json
+import threading
 import requests
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import dateutil.parser
 import tmdbsimple
 from appdirs import user_cache_dir
 
 from mediasort.enums import MediaType
-from mediasort import error
+from mediasort import error, httpclient, cache
 
 
 # global settings
 CONFIG = {}
 CACHEFILE = user_cache_dir('mediasort', 'ChrisOboe') + "/tmdb.cache"
+TMDB_BASE_URL = "https://api.themoviedb.org/3/"
 
 # caches
 CACHE = defaultdict(lambda: defaultdict(dict))
+# the most recently used raw responses
+RESPONSES = OrderedDict()
+RESPONSES_LOCK = threading.Lock()
+RESPONSES_COUNT = 256
+
+# the tmdbsimple class, its method, the api path and the cache kind of
+# every request
+ENDPOINTS = {
+    'find': (tmdbsimple.Find, 'info', 'find/{0}', 'find'),
+    'search_movie': (tmdbsimple.Search, 'movie', 'search/movie', 'search'),
+    'search_tv': (tmdbsimple.Search, 'tv', 'search/tv', 'search'),
+    'movie': (tmdbsimple.Movies, 'info', 'movie/{0}', 'entity'),
+    'tv': (tmdbsimple.TV, 'info', 'tv/{0}', 'entity'),
+    'season': (tmdbsimple.TV_Seasons, 'info', 'tv/{0}/season/{1}',
+               'season'),
+    'season_images': (tmdbsimple.TV_Seasons, 'images',
+                      'tv/{0}/season/{1}/images', 'season'),
+}
+
+# hours until a cached response of a kind is requested again
+RESPONSE_TTL = {
+    'search': 7 * 24,
+    'find': 30 * 24,
+    'entity': 7 * 24,
+    'season': 24,
+}
+# MB the cached responses may use
+RESPONSE_SIZE = 100
+
+# what is appended to the request of a movie or tvshow
+APPENDS = {
+    'movie': 'credits,release_dates,external_ids',
+    'tv': 'credits,content_ratings,external_ids,images',
+}
+
+# if set, load raises Missing instead of requesting tmdb
+OFFLINE = threading.local()
+
+
+class Missing(Exception):
+    """ Raised by load when a response isn't cached and requesting is
+    forbidden """
+    pass
 
 
 # INTERNAL
+def get_cache_key(endpoint, args, params):
+    """ returns the key of a response in the persistent cache """
+    path = ENDPOINTS[endpoint][2].format(*args)
+    return httpclient.get_url(TMDB_BASE_URL + path, params)
+
+
+def load_cached(endpoint, args, params):
+    """ returns a response from the persistent cache or None """
+    responses = CONFIG.get('responses')
+    if not responses or not responses['enabled']:
+        return None
+
+    kind = ENDPOINTS[endpoint][3]
+    return cache.load_response(get_cache_key(endpoint, args, params), kind,
+                               responses['ttl'][kind] * 3600)
+
+
+def save_cached(endpoint, args, params, response):
+    """ puts a response into the persistent cache """
+    responses = CONFIG.get('responses')
+    if not responses or not responses['enabled']:
+        return
+
+    cache.save_response(get_cache_key(endpoint, args, params),
+                        ENDPOINTS[endpoint][3], response,
+                        responses['size'] * 1048576)
+
+
+def get_key(endpoint, args, params):
+    """ returns the key of a response in memory """
+    return (endpoint, args, tuple(sorted(params.items())))
+
+
+def recall(key):
+    """ returns a response from memory or None """
+    with RESPONSES_LOCK:
+        if key not in RESPONSES:
+            return None
+        RESPONSES.move_to_end(key)
+        return RESPONSES[key]
+
+
+def remember(key, response):
+    """ keeps a response in memory. the least recently used responses are
+    dropped """
+    with RESPONSES_LOCK:
+        RESPONSES[key] = response
+        RESPONSES.move_to_end(key)
+        while len(RESPONSES) > RESPONSES_COUNT:
+            RESPONSES.popitem(last=False)
+
+
+def load(endpoint, *args, fresh=False, **params):
+    """ returns the (cached) response of a tmdb request. if fresh is set it
+    is requested again, even if it is cached """
+    key = get_key(endpoint, args, params)
+
+    response = None if fresh else recall(key)
+    if response is None:
+        # responses requested for the running run_async
+        response = getattr(OFFLINE, 'responses', {}).get((key, fresh))
+    if response is None:
+        if not fresh:
+            response = load_cached(endpoint, args, params)
+        if response is None:
+            if getattr(OFFLINE, 'enabled', False):
+                raise Missing(endpoint, args, params, fresh)
+            tmdbclass, method, _, _ = ENDPOINTS[endpoint]
+            response = getattr(tmdbclass(*args), method)(**params)
+            save_cached(endpoint, args, params, response)
+        remember(key, response)
+
+    return response
+
+
+async def load_async(endpoint, *args, fresh=False, **params):
+    """ requests a tmdb response asynchronously and caches it. if fresh is
+    set it is requested again, even if it is in memory """
+    key = get_key(endpoint, args, params)
+
+    response = None if fresh else recall(key)
+    if response is None:
+        path = ENDPOINTS[endpoint][2].format(*args)
+        response = await httpclient.get_json_async(
+            TMDB_BASE_URL + path,
+            dict(params, api_key=tmdbsimple.API_KEY))
+        save_cached(endpoint, args, params, response)
+        remember(key, response)
+
+    return response
+
+
+async def run_async(function, *args):
+    """ runs a function which gets its data with load without blocking.
+    every missing response is requested asynchronously before the function
+    runs again. the requested responses are kept until the function
+    succeeded, even if they were dropped from memory meanwhile """
+    responses = {}
+    while True:
+        OFFLINE.enabled = True
+        OFFLINE.responses = responses
+        try:
+            return function(*args)
+        except Missing as missing:
+            endpoint, loadargs, params, fresh = missing.args
+        finally:
+            OFFLINE.enabled = False
+            OFFLINE.responses = {}
+        try:
+            responses[(get_key(endpoint, loadargs, params), fresh)] = \
+                await load_async(endpoint, *loadargs, fresh=fresh, **params)
+        except httpclient.ERRORS:
+            raise error.NotEnoughData("Problem with accessing TMDb")
+
+
+def load_entity(endpoint, tmdb, language):
+    """ returns everything needed of a movie or tvshow in one request which
+    is shared by identification, metadata and images """
+    params = {
+        'language': language,
+        'append_to_response': APPENDS[endpoint],
+    }
+    if endpoint == 'tv':
+        params['include_image_language'] = "null"
+    return load(endpoint, tmdb, **params)
+
+
+def find_episode(season, identificator):
+    """ returns an episode of the response of a season or None """
+    for episode in season.get('episodes', []):
+        if episode['episode_number'] == int(identificator['episode']):
+            return episode
+    return None
+
+
+def get_episode(identificator, language):
+    """ returns an episode from the response of its whole season, so every
+    episode of a season shares one request. if the episode is missing, the
+    season is requested once again, because the cached one can be older
+    than the episode """
+    for fresh in (False, True):
+        try:
+            season = load('season',
+                          identificator['tmdb'],
+                          identificator['season'],
+                          fresh=fresh,
+                          language=language)
+        except requests.exceptions.HTTPError:
+            raise error.NotEnoughData("Problem with accessing TMDb")
+
+        episode = find_episode(season, identificator)
+        if episode is not None:
+            return episode
+
+    raise error.NotEnoughData("Episode not found on TMDb")
+
+
 def download_config():
     """ downloads and caches the tmdb config """
 
@@ -53,18 +256,36 @@ def download_config():
     return tmdb_config
 
 
+def get_language(language):
+    """ returns a language in the xx-YY form of tmdb """
+    parts = language.split('-', 1)
+    parts[0] = parts[0].lower()
+    if len(parts) > 1:
+        parts[1] = parts[1].upper()
+    return "-".join(parts)
+
+
 # MODULE
 def init(tmdbconfig):
     """ initialize tmdbsimple, caches stuff and validates config """
     global CONFIG
     tmdbsimple.API_KEY = tmdbconfig['api_key']
+    tmdbsimple.REQUESTS_SESSION = httpclient.get_session()
+    tmdbsimple.REQUESTS_TIMEOUT = httpclient.CONFIG['timeout']
     CONFIG['cache_validity'] = tmdbconfig['cache_validity']
     CONFIG['use_https'] = tmdbconfig['use_https']
     CONFIG['poster_size'] = tmdbconfig['sizes']['poster']
     CONFIG['background_size'] = tmdbconfig['sizes']['background']
     CONFIG['thumbnail_size'] = tmdbconfig['sizes']['thumbnail']
     CONFIG['certification_country'] = tmdbconfig['certification_country'].upper()
-    CONFIG['search_language'] = tmdbconfig['search_language'].upper()
+    CONFIG['search_language'] = get_language(tmdbconfig['search_language'])
+
+    responses = tmdbconfig.get('responses') or {}
+    CONFIG['responses'] = {
+        'enabled': responses.get('enabled', True),
+        'size': responses.get('size', RESPONSE_SIZE),
+        'ttl': dict(RESPONSE_TTL, **(responses.get('ttl') or {})),
+    }
 
     # if cachefile doesnt exist download the data
     if not os.path.exists(CACHEFILE):
@@ -98,6 +319,14 @@ def init(tmdbconfig):
                 tmdb['images']['still_sizes']))
 
 
+def clear_cache():
+    """ forgets the metadata, images and raw responses kept in memory. the
+    persistent cache of the responses stays """
+    CACHE.clear()
+    with RESPONSES_LOCK:
+        RESPONSES.clear()
+
+
 # IDENTIFICATOR
 def get_identificator(guess, identificator, callback):
     """ returns ids for the guessed videofile """
@@ -114,9 +343,7 @@ def get_identificator(guess, identificator, callback):
 
     # get tmdb id from imdb id
     if guess['type'] == MediaType.movie and identificator['imdb']:
-        info = tmdbsimple.Find(
-            identificator['imdb']
-        ).info(external_source='imdb_id')
+        info = load('find', identificator['imdb'], external_source='imdb_id')
 
         if guess['type'] == MediaType.movie:
             identificator['tmdb'] = info['movie_results'][0]['id']
@@ -129,8 +356,9 @@ def get_identificator(guess, identificator, callback):
 
         elif guess['type'] == MediaType.episode:
             identificator['tmdb'] = info['tv_results'][0]['id']
-            tvshow = tmdbsimple.TV(identificator['tmdb']).external_ids()
-            identificator['tvdb'] = tvshow['tvdb_id']
+            tvshow = load_entity('tv', identificator['tmdb'],
+                                 CONFIG['search_language'])
+            identificator['tvdb'] = tvshow['external_ids']['tvdb_id']
             identificator['tmdb'] = callback(
                 [{'title': info['tv_results'][0]['name'],
                   'description': info['tv_results'][0]['overview'],
@@ -143,27 +371,26 @@ def get_identificator(guess, identificator, callback):
         args = {'query': guess['title'], 'language': CONFIG['search_language']}
         if guess['type'] == MediaType.movie and guess['year']:
             args['year'] = guess['year']
-        search = tmdbsimple.Search()
+        search = {'results': []}
         if guess['type'] == MediaType.movie:
-            search.movie(**args)
+            search = load('search_movie', **args)
         elif guess['type'] == MediaType.episode:
-            search.tv(**args)
+            search = load('search_tv', **args)
 
-        if not search.results:
+        if not search['results']:
             raise error.NotEnoughData("TMDb search didn't found anything.")
 
-        if callback is None and len(search.results) == 1:
-            identificator['tmdb'] = search.results[0]['id']
+        if callback is None and len(search['results']) == 1:
+            identificator['tmdb'] = search['results'][0]['id']
         else:
             # call callback function
+            # the search results contain everything the callback needs,
+            # details are only loaded for the chosen one
             callback_list = []
-            for result in search.results:
+            for result in search['results']:
                 if guess['type'] == MediaType.movie:
-                    movie = tmdbsimple.Movies(result['id']).info(
-                        language=CONFIG['search_language'])
-
                     callback_list.append(
-                        {'title': "{0} ({1})".format(movie['title'], movie['release_date']),
+                        {'title': "{0} ({1})".format(result['title'], result.get('release_date')),
                          'descprition': result['overview'],
                          'id': result['id']}
                     )
@@ -180,15 +407,40 @@ def get_identificator(guess, identificator, callback):
 
     # now we should have a tmdb id. get the rest of ids
     if guess['type'] == MediaType.movie and not identificator['imdb']:
-        identificator['imdb'] = tmdbsimple.Movies(identificator['tmdb']).info()['imdb_id']
+        identificator['imdb'] = load_entity(
+            'movie', identificator['tmdb'],
+            CONFIG['search_language'])['imdb_id']
     elif guess['type'] == MediaType.episode:
-        tvshow = tmdbsimple.TV(identificator['tmdb']).external_ids()
+        tvshow = load_entity('tv', identificator['tmdb'],
+                             CONFIG['search_language'])['external_ids']
         identificator['imdb'] = tvshow['imdb_id']
         identificator['tvdb'] = tvshow['tvdb_id']
 
     return identificator
 
 
+async def get_identificator_async(guess, identificator, callback):
+    """ returns ids for the guessed videofile without blocking """
+
+    # get_identificator runs again for every missing response, so every
+    # question is only asked once
+    answers = []
+
+    def remembered(callback_list, mediatype):
+        for question, answer in answers:
+            if question == (callback_list, mediatype):
+                return answer
+        answer = callback(callback_list, mediatype)
+        answers.append(((callback_list, mediatype), answer))
+        return answer
+
+    def identify():
+        return get_identificator(guess, copy.deepcopy(identificator),
+                                 remembered if callback else None)
+
+    return await run_async(identify)
+
+
 def get_identificator_list(mediatype):
     if mediatype == MediaType.movie.name:
         return ['tmdb', 'imdb']
@@ -201,36 +453,57 @@ def get_needed_ids(mediatype):
     return ['tmdb']
 
 
-def get_metadata(identificator, metadatatype, language):
-    """ returns the metadata """
+def get_all_metadata(identificator, language):
+    """ returns all metadata of a movie, tvshow or episode """
     if identificator['type'] == MediaType.movie:
-        return get_movie_metadata(identificator, metadatatype, language)
+        return get_movie_metadata(identificator, language)
 
     elif identificator['type'] == MediaType.tvshow:
-        return get_tvshow_metadata(identificator, metadatatype, language)
+        return get_tvshow_metadata(identificator, language)
 
     elif identificator['type'] == MediaType.episode:
-        return get_episode_metadata(identificator, metadatatype, language)
+        return get_episode_metadata(identificator, language)
 
     else:
         raise error.InvalidMediaType
 
 
-def get_movie_metadata(identificator, metadatatype, language):
+def get_metadata(identificator, metadatatype, language):
+    """ returns the metadata """
+    return get_all_metadata(identificator, language)[metadatatype]
+
+
+def get_metadata_bulk(identificator, metadatatypes, language):
+    """ returns multiple metadata at once """
+    metadata = get_all_metadata(identificator, language)
+    return {metadatatype: metadata[metadatatype]
+            for metadatatype in metadatatypes}
+
+
+async def get_metadata_async(identificator, metadatatype, language):
+    """ returns the metadata without blocking """
+    return await run_async(get_metadata, identificator, metadatatype, language)
+
+
+async def get_metadata_bulk_async(identificator, metadatatypes, language):
+    """ returns multiple metadata at once without blocking """
+    return await run_async(get_metadata_bulk, identificator, metadatatypes,
+                           language)
+
+
+def get_movie_metadata(identificator, language):
     """ returns movie metadata """
 
     # use value from cache if cache exists
     try:
-        movie_cache = CACHE['metadata']['movie'][identificator['tmdb']]
+        movie_cache = CACHE['metadata']['movie'][(identificator['tmdb'], language)]
     except KeyError:
         movie_cache = None
 
-    if movie_cache:
-        return movie_cache[metadatatype]
+    if movie_cache is not None:
+        return movie_cache
 
-    movie = tmdbsimple.Movies(identificator['tmdb']).info(
-            language=language,
-            append_to_response='credits,release_dates')
+    movie = load_entity('movie', identificator['tmdb'], language)
 
     metadata = {
         'title': movie.get('title'),
@@ -282,27 +555,23 @@ def get_movie_metadata(identificator, metadatatype, language):
         )
 
     # write metadata to cache
-    CACHE['metadata']['movie'][identificator['tmdb']] = metadata
-    return metadata[metadatatype]
+    CACHE['metadata']['movie'][(identificator['tmdb'], language)] = metadata
+    return metadata
 
 
-def get_tvshow_metadata(identificator, metadatatype, language):
+def get_tvshow_metadata(identificator, language):
     """ returns tvshow metadata """
 
     try:
-        tvshow_cache = CACHE['metadata']['tvshow'][identificator['tmdb']]
+        tvshow_cache = CACHE['metadata']['tvshow'][(identificator['tmdb'], language)]
     except KeyError:
         tvshow_cache = None
 
     # use value from cache if cache exists
-    if tvshow_cache:
-        return tvshow_cache[metadatatype]
+    if tvshow_cache is not None:
+        return tvshow_cache
 
-    tvshow = tmdbsimple.TV(identificator['tmdb']).info(
-        language=language,
-        include_image_language="null",
-        append_to_response='credits,content_ratings,images'
-    )
+    tvshow = load_entity('tv', identificator['tmdb'], language)
 
     metadata = {
         'showtitle': tvshow.get('name'),
@@ -340,42 +609,36 @@ def get_tvshow_metadata(identificator, metadatatype, language):
              'role': actor['character']}
         )
 
-    CACHE['metadata']['tvshow'][identificator['tmdb']] = metadata
-    return metadata[metadatatype]
+    CACHE['metadata']['tvshow'][(identificator['tmdb'], language)] = metadata
+    return metadata
 
 
-def get_episode_metadata(identificator, metadatatype, language):
+def get_episode_metadata(identificator, language):
     """ returns episode metadata """
 
     try:
-        episode_cache = CACHE['metadata']['episode'][identificator['tmdb']][identificator['season']][identificator['episode']]
+        episode_cache = CACHE['metadata']['episode'][(identificator['tmdb'], language)][identificator['season']][identificator['episode']]
     except KeyError:
         episode_cache = None
 
     # use value from cache if cache exists
-    if episode_cache:
-        return episode_cache[metadatatype]
+    if episode_cache is not None:
+        return episode_cache
 
-    try:
-        episode = tmdbsimple.TV_Episodes(
-            identificator['tmdb'],
-            identificator['season'],
-            identificator['episode']
-        ).info(language=language)
-    except requests.exceptions.HTTPError:
-        raise error.NotEnoughData("Problem with accessing TMDb")
+    episode = get_episode(identificator, language)
+    tvshow = get_tvshow_metadata(identificator, language)
 
     metadata = {
-        'showtitle': get_tvshow_metadata(identificator, 'showtitle', language),
+        'showtitle': tvshow['showtitle'],
         'title': episode.get('name'),
         'premiered': episode.get('air_date'),
-        'show_premiered': get_tvshow_metadata(identificator, 'premiered', language),
+        'show_premiered': tvshow['premiered'],
         'plot': episode.get('overview'),
         'rating': episode.get('vote_average'),
         'votes': episode.get('vote_count'),
-        'studios': get_tvshow_metadata(identificator, 'studios', language),
-        'networks': get_tvshow_metadata(identificator, 'networks', language),
-        'certification': get_tvshow_metadata(identificator, 'certification', language),
+        'studios': tvshow['studios'],
+        'networks': tvshow['networks'],
+        'certification': tvshow['certification'],
     }
 
     metadata['directors'] = []
@@ -388,7 +651,8 @@ def get_episode_metadata(identificator, metadatatype, language):
             elif crewmember['job'] == 'Writer':
                 metadata['scriptwriters'].append(crewmember['name'])
 
-    metadata['actors'] = get_tvshow_metadata(identificator, 'actors', language)
+    # copied, the guest stars don't belong to the tvshow
+    metadata['actors'] = list(tvshow['actors'])
     if 'guest_stars' in episode:
         for guest_star in episode['guest_stars']:
             if guest_star['character']:
@@ -398,7 +662,7 @@ def get_episode_metadata(identificator, metadatatype, language):
 
 
     # write metadata to cache
-    tmdb = identificator['tmdb']
+    tmdb = (identificator['tmdb'], language)
     episode = identificator['episode']
     season = identificator['season']
     if tmdb not in CACHE['metadata']['episode']:
@@ -408,43 +672,64 @@ def get_episode_metadata(identificator, metadatatype, language):
 
     CACHE['metadata']['episode'][tmdb][season][episode] = metadata
 
-    return metadata[metadatatype]
+    return metadata
 
 
 # IMAGES
-def get_image(identificator, imagetype, language):
-    """ return the image """
+def get_all_images(identificator, language):
+    """ returns the urls of all images of a movie, tvshow, season or
+    episode """
     if identificator['type'] == MediaType.movie:
-        return get_movie_image(identificator, imagetype, language)
+        return get_movie_images(identificator, language)
 
     elif identificator['type'] == MediaType.tvshow:
-        return get_tvshow_image(identificator, imagetype, language)
+        return get_tvshow_images(identificator, language)
 
     elif identificator['type'] == MediaType.season:
-        return get_season_image(identificator, imagetype, language)
+        return get_season_images(identificator, language)
 
     elif identificator['type'] == MediaType.episode:
-        return get_episode_image(identificator, imagetype, language)
+        return get_episode_images(identificator, language)
 
     else:
         raise error.InvalidMediaType
 
 
-def get_movie_image(identificator, imagetype, language):
+def get_image(identificator, imagetype, language):
+    """ return the image """
+    return get_all_images(identificator, language).get(imagetype)
+
+
+def get_images_bulk(identificator, imagetypes, language):
+    """ returns multiple images at once """
+    images = get_all_images(identificator, language)
+    return {imagetype: images.get(imagetype) for imagetype in imagetypes}
+
+
+async def get_image_async(identificator, imagetype, language):
+    """ returns the image without blocking """
+    return await run_async(get_image, identificator, imagetype, language)
+
+
+async def get_images_bulk_async(identificator, imagetypes, language):
+    """ returns multiple images at once without blocking """
+    return await run_async(get_images_bulk, identificator, imagetypes,
+                           language)
+
+
+def get_movie_images(identificator, language):
     """ returns a image_type image for id for given languages"""
 
     try:
-        movie_cache = CACHE['images']['movie'][identificator['tmdb']]
+        movie_cache = CACHE['images']['movie'][(identificator['tmdb'], language)]
     except KeyError:
         movie_cache = None
 
     # use value from cache if cache exists
-    if movie_cache:
-        return movie_cache.get(imagetype)
+    if movie_cache is not None:
+        return movie_cache
 
-    movie = tmdbsimple.Movies(identificator['tmdb']).info(
-        language=language
-    )
+    movie = load_entity('movie', identificator['tmdb'], language)
 
     images = {}
     if movie['poster_path']:
@@ -457,26 +742,22 @@ def get_movie_image(identificator, imagetype, language):
                                CONFIG['background_size'] + \
                                movie['backdrop_path']
 
-    CACHE['images']['movie'][identificator['tmdb']] = images
-    return images.get(imagetype)
+    CACHE['images']['movie'][(identificator['tmdb'], language)] = images
+    return images
 
 
-def get_tvshow_image(identificator, imagetype, language):
+def get_tvshow_images(identificator, language):
     """ returns the url of a tvshow image """
 
     try:
-        tvshow_cache = CACHE['images']['tvshow'][identificator['tmdb']]
+        tvshow_cache = CACHE['images']['tvshow'][(identificator['tmdb'], language)]
     except KeyError:
         tvshow_cache = None
 
-    if tvshow_cache:
-        return tvshow_cache.get(imagetype)
+    if tvshow_cache is not None:
+        return tvshow_cache
 
-    tvshow = tmdbsimple.TV(identificator['tmdb']).info(
-        language=language,
-        include_image_language="null",
-        append_to_response='images'
-    )
+    tvshow = load_entity('tv', identificator['tmdb'], language)
 
     images = {}
     if tvshow['images']['posters']:
@@ -489,28 +770,26 @@ def get_tvshow_image(identificator, imagetype, language):
                                CONFIG['background_size'] + \
                                tvshow['images']['backdrops'][0]['file_path']
 
-    CACHE['images']['tvshow'][identificator['tmdb']] = images
-    return images.get(imagetype)
+    CACHE['images']['tvshow'][(identificator['tmdb'], language)] = images
+    return images
 
 
-def get_season_image(identificator, imagetype, language):
+def get_season_images(identificator, language):
     """ returns the url of a season image"""
 
     try:
-        season_cache = CACHE['images']['season'][identificator['tmdb']][identificator['season']]
+        season_cache = CACHE['images']['season'][(identificator['tmdb'], language)][identificator['season']]
     except KeyError:
         season_cache = None
 
-    if season_cache:
-        return season_cache.get(imagetype)
+    if season_cache is not None:
+        return season_cache
 
-    season = tmdbsimple.TV_Seasons(
-        identificator['tmdb'],
-        identificator['season']
-    ).images(
-        language=language,
-        #include_image_language="null" #bug in tmdb
-    )
+    # include_image_language="null" #bug in tmdb
+    season = load('season_images',
+                  identificator['tmdb'],
+                  identificator['season'],
+                  language=language)
 
     images = {}
     if season['posters']:
@@ -518,31 +797,27 @@ def get_season_image(identificator, imagetype, language):
                            CONFIG['poster_size'] + \
                            season['posters'][0]['file_path']
 
-    tmdb = identificator['tmdb']
+    tmdb = (identificator['tmdb'], language)
     season = identificator['season']
     if tmdb not in CACHE['images']['season']:
         CACHE['images']['season'][tmdb] = {}
 
     CACHE['images']['season'][tmdb][season] = images
-    return images.get(imagetype)
+    return images
 
 
-def get_episode_image(identificator, imagetype, language):
+def get_episode_images(identificator, language):
     """ returns the episode thumnail """
 
     try:
-        episode_cache = CACHE['images']['episode'][identificator['tmdb']][identificator['season']][identificator['episode']]
+        episode_cache = CACHE['images']['episode'][(identificator['tmdb'], language)][identificator['season']][identificator['episode']]
     except KeyError:
         episode_cache = None
 
-    if episode_cache:
-        return episode_cache[imagetype]
+    if episode_cache is not None:
+        return episode_cache
 
-    episode = tmdbsimple.TV_Episodes(
-        identificator['tmdb'],
-        identificator['season'],
-        identificator['episode']
-    ).info(language=language)
+    episode = get_episode(identificator, language)
 
     if episode['still_path']:
         images = {
@@ -554,7 +829,7 @@ def get_episode_image(identificator, imagetype, language):
     else:
         images = {'thumbnail': None}
 
-    tmdb = identificator['tmdb']
+    tmdb = (identificator['tmdb'], language)
     episode = identificator['episode']
     season = identificator['season']
     if tmdb not in CACHE['images']['episode']:
@@ -563,4 +838,4 @@ def get_episode_image(identificator, imagetype, language):
         CACHE['images']['episode'][tmdb][season] = {}
 
     CACHE['images']['episode'][tmdb][season][episode] = images
-    return images[imagetype]
+    return images
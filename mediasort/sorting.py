@@ -15,20 +15,55 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
+import re
 import copy
+import time
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from functools import partial
+from types import MappingProxyType, ModuleType
 from shutil import move
 import logging
 from fuzzywuzzy import fuzz
 
-from mediasort import error
-from mediasort.enums import PluginType
+from mediasort import error, httpclient, cache, download
+from mediasort.enums import PluginType, MediaType
 from mediasort.template import get_paths, write_nfo
-from mediasort.download import download
 
 
 # create logger
 logger = logging.getLogger('mediasort')
 
+# serializes nfo writes and media moves when sorting in multiple threads
+WRITE_LOCK = threading.Lock()
+
+# how many requests a plugin may have in flight in async_sort by default
+ASYNC_LIMIT = 8
+
+# hooks of plugins which return multiple types at once
+BULK_HOOKS = {
+    'get_metadata': 'get_metadata_bulk',
+    'get_image': 'get_images_bulk',
+}
+
+# priority of the requests a hook makes
+PRIORITIES = {
+    'get_identificator': httpclient.IDENTIFICATION,
+    'get_metadata': httpclient.METADATA,
+    'get_metadata_bulk': httpclient.METADATA,
+    'get_image': httpclient.IMAGES,
+    'get_images_bulk': httpclient.IMAGES,
+}
+
+# resolves the languages of metadata and images at once
+LANGUAGE_EXECUTOR = ThreadPoolExecutor(max_workers=16)
+
+# seconds until a failed videofile is tried again, doubled for every failure
+RETRY = 3600
+RETRY_MAX = 7 * 24 * 3600
+
 
 # helpers
 def contains_elements(elements, dictionary):
@@ -41,11 +76,56 @@ def contains_elements(elements, dictionary):
     return True
 
 
-# plugins
-def get_guess(filepath, providers):
-    """ returns a guess for a filename """
+def use_guess_cache(settings):
+    """ returns if guesses should be cached """
+    return settings.get('cache', {}).get('guesses', True)
+
+
+def get_result(abspath):
+    """ returns the result of a videofile which isn't sorted yet """
+    return {
+        'videofile': abspath,
+        'success': False,
+        'skipped': False,
+        'error': None,
+    }
+
+
+def skip_processed(result, settings):
+    """ marks the result as skipped and returns True if the videofile was
+    already sorted or failed too recently """
+    incremental = settings.get('incremental', {})
+    if not incremental.get('enabled') or incremental.get('force'):
+        return False
+
+    last = cache.load_processed(result['videofile'])
+    if last is None:
+        return False
+
+    if last['outcome'] == 'failed':
+        backoff = incremental.get('retry', RETRY) * 2 ** (last['attempts'] - 1)
+        backoff = min(backoff, incremental.get('retry_max', RETRY_MAX))
+        if time.time() >= last['timestamp'] + backoff:
+            return False
+
+    logger.info("Skipping \"{0}\", it was {1} before".format(
+        result['videofile'], last['outcome']))
+    result['skipped'] = True
+    return True
+
+
+def remember_result(result, settings):
+    """ remembers the outcome of sorting a videofile for incremental runs """
+    if not settings.get('incremental', {}).get('enabled') or result['skipped']:
+        return
+    cache.save_processed(result['videofile'],
+                         'sorted' if result['success'] else 'failed')
 
-    guess = {
+
+# plugins
+def get_empty_guess():
+    """ returns a guess without values """
+    return {
          'filepath': None,
          'type': None,
          'title': None,
@@ -56,15 +136,11 @@ def get_guess(filepath, providers):
          'episode': None,
      }
 
-    for provider in providers:
-        logger.debug("Using {0} to guess from file".format(provider.__name__))
-        try:
-            guess.update(provider.get_guess(filepath))
-        except error.NotEnoughData:
-            logger.debug("{0} didn't got anything".format(provider.__name__))
-            pass
 
-    if 'type' not in guess:
+def check_guess(guess):
+    """ raises NotEnoughData if a needed value is missing """
+
+    if guess.get('type') is None:
         raise error.NotEnoughData("Needed value couldn't be guessed")
 
     needed = ['filepath', 'title']
@@ -74,11 +150,120 @@ def get_guess(filepath, providers):
         raise error.NotEnoughData("Needed value couldn't be guessed")
 
     logger.debug("Guessed as {0}".format(guess['type'].name))
+
+
+def get_guess(filepath, providers, cached=False):
+    """ returns a guess for a filename. if cached is set, unchanged files
+    use the guess of the last time """
+
+    if cached:
+        version = cache.get_guess_version(providers)
+        guess = cache.load_guess(filepath, version)
+        if guess is not None:
+            logger.debug("Using cached guess")
+            if isinstance(guess, error.NotEnoughData):
+                raise guess
+            return guess
+
+    guess = get_empty_guess()
+
+    for provider in providers:
+        logger.debug("Using {0} to guess from file".format(provider.__name__))
+        try:
+            guess.update(provider.get_guess(filepath))
+        except error.NotEnoughData:
+            logger.debug("{0} didn't got anything".format(provider.__name__))
+            pass
+
+    try:
+        check_guess(guess)
+    except error.NotEnoughData as e:
+        if cached:
+            cache.save_guess(filepath, version, e)
+        raise
+
+    if cached:
+        cache.save_guess(filepath, version, guess)
     return guess
 
 
-def get_identificator(guess, providers, ids, callback):
-    """ returns a identificator for a guess """
+def get_provider_guesses(provider, filepaths):
+    """ returns what a provider guessed for every filename. a file the
+    provider failed on gets the error instead of a guess """
+    if hasattr(provider, 'get_guesses'):
+        try:
+            return provider.get_guesses(filepaths)
+        except Exception:
+            logger.exception("{0} failed, guessing one file at a time".format(
+                provider.__name__))
+
+    provided = []
+    for filepath in filepaths:
+        try:
+            provided.append(provider.get_guess(filepath))
+        except error.NotEnoughData as e:
+            provided.append(e)
+        except Exception as e:
+            logger.exception("Guessing \"{0}\" failed".format(filepath))
+            provided.append(e)
+    return provided
+
+
+def get_guesses(filepaths, providers, cached=False):
+    """ returns a guess for every filename. providers with a get_guesses
+    function get all filenames at once. if a file couldn't be guessed its
+    guess is the NotEnoughData error, if a provider failed on it the error
+    of the provider. if cached is set, unchanged files use the guess of the
+    last time """
+
+    filepaths = list(filepaths)
+
+    if cached:
+        version = cache.get_guess_version(providers)
+        results = [cache.load_guess(f, version) for f in filepaths]
+        missing = [i for i, result in enumerate(results) if result is None]
+        logger.debug("Using {0} cached guesses".format(
+            len(filepaths) - len(missing)))
+        if missing:
+            guessed = get_guesses([filepaths[i] for i in missing], providers)
+            for i, guess in zip(missing, guessed):
+                # a failed provider is asked again the next time
+                if not isinstance(guess, Exception) or \
+                   isinstance(guess, error.NotEnoughData):
+                    cache.save_guess(filepaths[i], version, guess)
+                results[i] = guess
+        return results
+
+    guesses = [get_empty_guess() for _ in filepaths]
+    errors = [None for _ in filepaths]
+
+    for provider in providers:
+        logger.debug("Using {0} to guess from files".format(provider.__name__))
+        provided = get_provider_guesses(provider, filepaths)
+
+        for i, providerguess in enumerate(provided):
+            if isinstance(providerguess, error.NotEnoughData):
+                logger.debug("{0} didn't got anything".format(
+                    provider.__name__))
+            elif isinstance(providerguess, Exception):
+                errors[i] = errors[i] or providerguess
+            else:
+                guesses[i].update(providerguess)
+
+    for i, guess in enumerate(guesses):
+        if errors[i] is not None:
+            guesses[i] = errors[i]
+            continue
+        try:
+            check_guess(guess)
+        except error.NotEnoughData as e:
+            guesses[i] = e
+
+    return guesses
+
+
+def get_default_callback(guess):
+    """ returns the callback used if no identificator callback is given """
 
     def custom_sort(identificator_list, medianame):
         """ sometimes the identificator sorting sucks hard (tmdbs search is
@@ -101,115 +286,291 @@ def get_identificator(guess, providers, ids, callback):
         logger.debug("Selected \"{0}\"".format(best_match['entry']['title']))
         return best_match['entry']['id']
 
-    if callback is None:
-        callback = custom_sort
+    return custom_sort
+
 
+def get_empty_identificator(guess):
+    """ returns a identificator without ids for a guess """
     identificator = {'type': guess['type']}
     for idtype in guess['type'].value.idTypes.value:
         identificator[idtype] = None
+    return identificator
+
+
+def check_identificator(guess, identificator, ids):
+    """ raises NotEnoughData if a wanted id is missing """
+    if not contains_elements(ids['wanted'][guess['type'].name], identificator):
+        raise error.NotEnoughData(
+            "Needed id wasn't provided by any selected identificator"
+        )
+
+
+def get_identificator(guess, providers, ids, callback):
+    """ returns a identificator for a guess """
+
+    if callback is None:
+        callback = get_default_callback(guess)
+
+    identificator = get_empty_identificator(guess)
 
     for provider in providers[guess['type'].name]:
         logger.debug("Using {0} to get ids".format(provider.__name__))
         try:
-            identificator.update(
-                provider.get_identificator(guess, identificator, callback)
-            )
+            with httpclient.priority(PRIORITIES['get_identificator']):
+                identificator.update(
+                    provider.get_identificator(guess, identificator, callback)
+                )
         except error.NotEnoughData:
             logger.debug("{0} didn't got anything".format(provider.__name__))
             pass
 
-    if not contains_elements(ids['wanted'][guess['type'].name], identificator):
-        raise error.NotEnoughData(
-            "Needed id wasn't provided by any selected identificator"
-        )
+    check_identificator(guess, identificator, ids)
+    return identificator
+
+
+def get_group_registry():
+    """ returns a registry of identificators, so videofiles of the same
+    movie or tvshow are only identified once while sorting a batch """
+    return {
+        'lock': threading.Lock(),
+        'identificators': {},
+    }
+
+
+def get_group_key(guess):
+    """ returns the key of the guesses which are identified together or None
+    if the videofile has to be identified alone """
+    # a nfo can contain ids which only belong to its videofile
+    if os.path.isfile(os.path.splitext(guess['filepath'])[0] + ".nfo"):
+        return None
+
+    title = " ".join(re.findall(r'\w+', str(guess['title']).lower()))
+    return (guess['type'].name, title, guess.get('year'))
 
+
+def fan_out(identificator, guess):
+    """ returns a copy of the identificator of a group with the values of a
+    guess which differ between the videofiles of the group """
+    identificator = copy.deepcopy(identificator)
+    for value in guess['type'].value.neededGuess.value:
+        if value in identificator:
+            identificator[value] = guess[value]
     return identificator
 
 
-def get_metadata(identificator, languages, providers):
-    """ returns the metadata """
+def get_grouped_identificator(guess, providers, ids, callback, groups=None):
+    """ returns a identificator for a guess. guesses of the same group share
+    the identificator of the first one. groups is a registry from
+    get_group_registry """
+
+    key = None
+    if groups is not None:
+        key = get_group_key(guess)
+    if key is None:
+        return get_identificator(guess, providers, ids, callback)
+
+    with groups['lock']:
+        future = groups['identificators'].get(key)
+        first = future is None
+        if first:
+            future = groups['identificators'][key] = Future()
+
+    if first:
+        try:
+            future.set_result(
+                get_identificator(guess, providers, ids, callback))
+        except Exception as e:
+            # later videofiles of the group try it again
+            with groups['lock']:
+                del groups['identificators'][key]
+            future.set_exception(e)
+    else:
+        logger.debug("Using identificator of the same group")
+
+    return fan_out(future.result(), guess)
+
+
+# dispatch plan
+def get_needed_ids(provider, mediatype):
+    """ returns the ids a provider needs for a mediatype """
+    needed = None
+    if hasattr(provider, 'get_needed_ids'):
+        needed = provider.get_needed_ids(mediatype.name)
+    return tuple(needed or ())
+
+
+def get_step(mediatype, types, providers):
+    """ returns the types of a mediatype and the rounds of providers which
+    resolve them. in every round each type without a value asks its next
+    provider, so every provider of a round comes with its types and the
+    ids it needs """
+    rounds = []
+    for number in range(max([len(providers[t]) for t in types] or [0])):
+        providertypes = {}
+        for valuetype in types:
+            if number < len(providers[valuetype]):
+                providertypes.setdefault(
+                    providers[valuetype][number], []).append(valuetype)
+        rounds.append(tuple(
+            (provider, get_needed_ids(provider, mediatype),
+             tuple(providertypes[provider]))
+            for provider in providertypes))
+    return (tuple(types), tuple(rounds))
+
+
+def build_plan(plugins):
+    """ returns a frozen plan for every mediatype how its metadata and
+    images are resolved """
+    plan = {}
+    for mediatype in MediaType:
+        plan[mediatype.name] = MappingProxyType({
+            'metadata': get_step(
+                mediatype,
+                list(mediatype.value.metadataTypes.value),
+                plugins[PluginType.metadata.name][mediatype.name]),
+            'images': get_step(
+                mediatype,
+                list(mediatype.value.imageTypes.value),
+                plugins[PluginType.images.name][mediatype.name]),
+        })
+    return MappingProxyType(plan)
+
+
+def get_plan(plugins):
+    """ returns the dispatch plan of the plugins. it's built by
+    initialize_plugins or on first use """
+    if 'plan' not in plugins:
+        plugins['plan'] = build_plan(plugins)
+    return plugins['plan']
+
+
+def call_provider(hook, provider, identificator, types, language):
+    """ returns the values of multiple types from a provider. providers
+    without a bulk hook are asked for every type """
+    logger.debug("Using {0}/{2} to get {1}".format(
+        provider.__name__,
+        ", ".join(types),
+        language
+    ))
 
-    metadata = {}
-    for metadatatype in identificator['type'].value.metadataTypes.value:
-        metadata[metadatatype] = None
+    with httpclient.priority(PRIORITIES[hook]):
+        if hasattr(provider, BULK_HOOKS[hook]):
+            return getattr(provider, BULK_HOOKS[hook])(identificator, types,
+                                                       language)
 
-    for metadatatype in metadata:
+        return {valuetype: getattr(provider, hook)(identificator, valuetype,
+                                                   language)
+                for valuetype in types}
+
+
+def get_missing(values, providertypes, needed, identificator):
+    """ returns the types a provider is asked for. nothing is asked if the
+    identificator lacks an id the provider needs """
+    if not contains_elements(needed, identificator):
+        return []
+    return [t for t in providertypes if values[t] is None]
+
+
+def resolve_language(hook, identificator, step, language):
+    """ returns the first value of every type its providers give in one
+    language. every provider gets all types it's asked for at once """
+
+    types, rounds = step
+    values = dict.fromkeys(types)
+
+    for providers in rounds:
+        for provider, needed, providertypes in providers:
+            missing = get_missing(values, providertypes, needed,
+                                  identificator)
+            if not missing:
+                continue
+            provided = call_provider(hook, provider, identificator, missing,
+                                     language)
+            for valuetype in missing:
+                values[valuetype] = provided.get(valuetype)
+
+    return values
+
+
+def merge_languages(types, languages):
+    """ returns the value of every type from the first language which has
+    one. languages contains functions returning the values of a language,
+    so a language is only looked at if it's needed """
+
+    values = {}
+    for valuetype in types:
+        values[valuetype] = None
         for language in languages:
-            for provider in providers[metadatatype]:
-                if metadata[metadatatype] is None:
-                    logger.debug("Using {0}/{2} to get {1}".format(
-                        provider.__name__,
-                        metadatatype,
-                        language
-                    ))
-                    metadata[metadatatype] = provider.get_metadata(
-                        identificator,
-                        metadatatype,
-                        language
-                    )
-
-    return metadata
+            values[valuetype] = language()[valuetype]
+            if values[valuetype] is not None:
+                break
+
+    return values
+
+
+def resolve(hook, identificator, step, languages):
+    """ returns the first value of every type of a step of the plan in the
+    order of languages and providers. all languages are resolved at once """
+
+    if len(languages) == 1:
+        return resolve_language(hook, identificator, step, languages[0])
+
+    futures = [LANGUAGE_EXECUTOR.submit(resolve_language, hook,
+                                        identificator, step, language)
+               for language in languages]
+    return merge_languages(step[0], [future.result for future in futures])
+
+
+def get_metadata(identificator, languages, providers):
+    """ returns the metadata """
+    mediatype = identificator['type']
+    return resolve('get_metadata', identificator,
+                   get_step(mediatype,
+                            list(mediatype.value.metadataTypes.value),
+                            providers),
+                   languages)
 
 
 def get_images(identificator, languages, providers):
     """ returns a specific image url """
+    mediatype = identificator['type']
+    return resolve('get_image', identificator,
+                   get_step(mediatype,
+                            list(mediatype.value.imageTypes.value),
+                            providers),
+                   languages)
 
-    images = {}
-    for imagetype in identificator['type'].value.imageTypes.value:
-        images[imagetype] = None
 
-    for imagetype in images:
-        for language in languages:
-            for provider in providers[imagetype]:
-                if images[imagetype] is None:
-                    logger.debug("Using {0}/{2} to get {1}".format(
-                        provider.__name__,
-                        imagetype,
-                        language
-                    ))
-                    images[imagetype] = provider.get_image(
-                        identificator,
-                        imagetype,
-                        language
-                    )
-
-    return images
+# sorting helpers
+def get_modules(plugins):
+    """ returns every plugin module once """
+    modules = []
 
+    def add(value):
+        if isinstance(value, dict):
+            value = list(value.values())
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                add(item)
+        elif isinstance(value, ModuleType) and value not in modules:
+            modules.append(value)
 
-# sorting helpers
-def meta_sort(guess, identificator, metadata, plugins, paths, languages,
-              settings):
-    """ writes nfo and downloads images"""
-    images = get_images(
-        identificator,
-        languages['metadata'],
-        plugins[PluginType.images.name][identificator['type'].name]
-    )
-
-    # write the nfo
-    if ('nfo' in paths and
-       (settings['overwrite']['nfo'] or not os.path.isfile(paths['nfo']))):
-        logger.debug("Writing " + paths['nfo'])
-        if not settings['simulate']:
-            write_nfo(paths['template'],
-                      {'metadata': metadata,
-                       'identificator': identificator,
-                       'guess': guess},
-                      paths['nfo'])
-
-    # download the images
-    for image in images:
-        if images[image] and \
-           (settings['overwrite']['images'] or not os.path.isfile(paths[image])):
-            logger.debug("Downloading " + paths[image])
-            if not settings['simulate']:
-                download(images[image], paths[image])
+    add(plugins)
+    return modules
 
 
-# sorting
-def sort(videofile, plugins, ids, paths, languages, settings, callbacks=None):
-    """ sorts a videofile """
-    videofile = {
+def clear_caches(plugins):
+    """ drops what the plugins and the downloads keep in memory. nothing may
+    be sorted meanwhile """
+    for module in get_modules(plugins):
+        if hasattr(module, 'clear_cache'):
+            module.clear_cache()
+    download.clear_cache()
+
+
+def get_videofile(videofile):
+    """ returns the informations about a videofile needed for sorting """
+    return {
         'basename': os.path.basename(videofile),
         'abspath': os.path.abspath(videofile),
         'extension': os.path.splitext(
@@ -217,89 +578,578 @@ def sort(videofile, plugins, ids, paths, languages, settings, callbacks=None):
         )[1].lower()[1:]
     }
 
-    if not callbacks:
-        callbacks = {}
 
-    logger.info("Processing \"{0}\"".format(videofile['abspath']))
+def get_identificators(identificator):
+    """ returns the identificator followed by the identificators of its
+    successors """
+    identificators = [identificator]
 
+    if getattr(identificator['type'].value, 'get_successors', None) is not None:
+        for successor in identificator['type'].value.get_successors():
+            logger.debug("Processing depenendency: {0}".format(successor.name))
+
+            newIdentificator = copy.deepcopy(identificator)
+            newIdentificator['type'] = successor
+            identificators.append(newIdentificator)
+
+    return identificators
+
+
+def render_paths(entries, paths):
+    """ renders the paths of the entries. successors use the metadata of the
+    videofile """
+    metadata = entries[0]['metadata']
+
+    entries[0]['paths'] = get_paths(
+        paths[entries[0]['identificator']['type'].name],
+        {'metadata': metadata,
+         'identificator': entries[0]['identificator'],
+         'guess': entries[0]['guess']})
+
+    for entry in entries[1:]:
+        entry['paths'] = get_paths(
+            paths[entry['identificator']['type'].name],
+            {'metadata': metadata,
+             'identificator': entry['identificator']})
+
+
+def get_successor_registry():
+    """ returns a registry of successors which are done, so every tvshow and
+    season is only processed once while sorting a batch of videofiles """
+    return {
+        'lock': threading.Lock(),
+        'done': set(),
+        'running': set(),
+    }
+
+
+def get_successor_key(identificator):
+    """ returns the key of a successor in the registry or None if it can't
+    be identified """
+    if identificator.get('tmdb') is None:
+        return None
+
+    season = None
+    if identificator['type'] == MediaType.season:
+        season = identificator.get('season')
+
+    return (identificator['type'].name, identificator['tmdb'], season)
+
+
+def claim_successor(registry, identificator):
+    """ returns True if the caller has to process the successor and False if
+    it's already done or another videofile processes it. this never waits,
+    the videofile which claimed a successor finishes it alone """
+    key = get_successor_key(identificator)
+    if registry is None or key is None:
+        return True
+
+    with registry['lock']:
+        if key in registry['done'] or key in registry['running']:
+            return False
+        registry['running'].add(key)
+        return True
+
+
+def finish_successors(registry, entries, done):
+    """ marks the successors the entries claimed as done or releases them so
+    another videofile can process them again """
+    if registry is None:
+        return
+
+    for entry in entries:
+        if not entry.pop('claimed', False):
+            continue
+        key = get_successor_key(entry['identificator'])
+        if key is None:
+            continue
+        with registry['lock']:
+            if done:
+                registry['done'].add(key)
+            registry['running'].discard(key)
+
+
+def get_entries(guess, identificator, plugins, paths, languages,
+                successors=None):
+    """ returns everything needed to write the videofile and its successors.
+    the first entry always belongs to the videofile itself. successors which
+    are already done in the registry are left out """
+
+    entries = []
     try:
-        guess = get_guess(videofile['abspath'], plugins[PluginType.guess.name])
-        identificator = get_identificator(guess,
-                                          plugins[PluginType.identificator.name],
-                                          ids,
-                                          callbacks.get('identificator'))
+        for number, newIdentificator in enumerate(
+                get_identificators(identificator)):
+            if number > 0 and \
+               not claim_successor(successors, newIdentificator):
+                logger.debug("{0} is done by another videofile".format(
+                    newIdentificator['type'].name))
+                continue
 
-        metadata = get_metadata(
-            identificator,
-            languages['metadata'],
-            plugins[PluginType.metadata.name][identificator['type'].name]
-        )
+            plan = get_plan(plugins)[newIdentificator['type'].name]
+            entry = {
+                'guess': guess,
+                'identificator': newIdentificator,
+                'claimed': number > 0,
+            }
+            entries.append(entry)
+            entry['metadata'] = resolve('get_metadata', newIdentificator,
+                                        plan['metadata'],
+                                        languages['metadata'])
+            entry['images'] = resolve('get_image', newIdentificator,
+                                      plan['images'], languages['metadata'])
+    except Exception:
+        finish_successors(successors, entries, False)
+        raise
 
-        # get paths
-        try:
-            rendered_paths = get_paths(
-                paths[identificator['type'].name],
-                {'metadata': metadata,
-                 'identificator': identificator,
-                 'guess': guess})
-        except PermissionError as e:
-            logger.error("You don't have needed permissions: {0}".format(e))
-            logger.debug("---- Cut here ----\n")
-            return None
-
-        # create base path
-        if not settings['simulate']:
-            os.makedirs(rendered_paths['base'], exist_ok=True)
-
-        # write nfo and download images
-        try:
-            meta_sort(guess, identificator, metadata, plugins, rendered_paths,
-                      languages, settings)
-        except FileNotFoundError as e:
-            logger.error("A needed file wasn't found: {0}".format(e))
-            logger.debug("---- Cut here ----\n")
-            return None
-
-        # move the media
+    render_paths(entries, paths)
+    return entries
+
+
+def queue_entry(entry, settings):
+    """ creates the base path and queues the downloads of the images of an
+    entry. returns the futures of the downloads """
+    paths = entry['paths']
+    images = entry['images']
+    futures = []
+
+    if not settings['simulate']:
+        os.makedirs(paths['base'], exist_ok=True)
+
+    for image in images:
+        if images[image] and \
+           (settings['overwrite']['images'] or not os.path.isfile(paths[image])):
+            logger.debug("Downloading " + paths[image])
+            if not settings['simulate']:
+                futures.append(download.queue(images[image], paths[image]))
+
+    return futures
+
+
+def download_entry(entry, settings):
+    """ downloads the images of an entry """
+    download.wait(queue_entry(entry, settings))
+
+
+def write_entry(entry, settings):
+    """ writes the nfo of an entry """
+    paths = entry['paths']
+
+    with WRITE_LOCK:
+        if ('nfo' in paths and
+           (settings['overwrite']['nfo'] or not os.path.isfile(paths['nfo']))):
+            logger.debug("Writing " + paths['nfo'])
+            if not settings['simulate']:
+                write_nfo(paths['template'],
+                          {'metadata': entry['metadata'],
+                           'identificator': entry['identificator'],
+                           'guess': entry['guess']},
+                          paths['nfo'])
+
+
+def move_media(videofile, entry, settings):
+    """ moves the videofile to the media path of its entry """
+    paths = entry['paths']
+
+    with WRITE_LOCK:
         if settings['overwrite']['media'] or not \
-           os.path.isfile(rendered_paths['media']):
-            logger.debug("Moving media to " + rendered_paths['media'])
+           os.path.isfile(paths['media']):
+            logger.debug("Moving media to " + paths['media'])
             if not settings['simulate']:
                 move(videofile['abspath'],
-                     "{0}.{1}".format(rendered_paths['media'],
+                     "{0}.{1}".format(paths['media'],
                                       videofile['extension']))
 
-        # sort successors
-        if getattr(identificator['type'].value, 'get_successors', None) is not None:
-            for successor in identificator['type'].value.get_successors():
-                logger.debug("Processing depenendency: {0}".format(successor.name))
 
-                newIdentificator = copy.deepcopy(identificator)
-                newIdentificator['type'] = successor
+def store(videofile, entries, settings):
+    """ downloads images, writes nfos and moves the media. the images are
+    downloaded while the nfos are written, the media is only moved if all
+    of them succeeded """
+    futures = []
+    for entry in entries:
+        futures.extend(queue_entry(entry, settings))
+    for entry in entries:
+        write_entry(entry, settings)
+    download.wait(futures)
+    move_media(videofile, entries[0], settings)
 
-                newMetadata = get_metadata(
-                    newIdentificator,
-                    languages['metadata'],
-                    plugins[PluginType.metadata.name][newIdentificator['type'].name]
-                )
 
-                newPaths = get_paths(
-                    paths[newIdentificator['type'].name],
-                    {'metadata': metadata,
-                     'identificator': newIdentificator}
-                )
+def meta_sort(guess, identificator, metadata, plugins, paths, languages,
+              settings):
+    """ writes nfo and downloads images"""
+    entry = {
+        'guess': guess,
+        'identificator': identificator,
+        'metadata': metadata,
+        'paths': paths,
+        'images': get_images(
+            identificator,
+            languages['metadata'],
+            plugins[PluginType.images.name][identificator['type'].name]
+        )
+    }
+
+    write_entry(entry, settings)
+    download_entry(entry, settings)
 
-                meta_sort(guess,
-                          newIdentificator,
-                          newMetadata,
-                          plugins,
-                          newPaths,
-                          languages,
-                          settings)
 
-    except (error.NotEnoughData, error.CallbackBreak) as e:
+def failed(result, e):
+    """ logs why sorting a videofile failed and returns the result """
+    if isinstance(e, PermissionError):
+        logger.error("You don't have needed permissions: {0}".format(e))
+    elif isinstance(e, FileNotFoundError):
+        logger.error("A needed file wasn't found: {0}".format(e))
+    else:
         logger.error(str(e))
-        logger.debug("---- Cut here ----\n")
-        return None
+    logger.debug("---- Cut here ----\n")
+    result['error'] = e
+    return result
+
+
+# errors which only stop sorting of the current videofile
+SORT_ERRORS = (error.NotEnoughData, error.CallbackBreak,
+               PermissionError, FileNotFoundError)
+
+
+# sorting
+def sort(videofile, plugins, ids, paths, languages, settings, callbacks=None,
+         guess=None, successors=None, groups=None):
+    """ sorts a videofile and returns a result. if guess is given the
+    videofile isn't guessed again. successors and groups are registries
+    shared by the videofiles of a batch """
+    videofile = get_videofile(videofile)
+
+    if not callbacks:
+        callbacks = {}
+
+    result = get_result(videofile['abspath'])
+    if skip_processed(result, settings):
+        return result
+
+    logger.info("Processing \"{0}\"".format(videofile['abspath']))
+
+    result = sort_videofile(videofile, result, plugins, ids, paths, languages,
+                            settings, callbacks, guess, successors, groups)
+    remember_result(result, settings)
+    return result
+
+
+def sort_videofile(videofile, result, plugins, ids, paths, languages,
+                   settings, callbacks, guess, successors=None, groups=None):
+    """ does the sorting for sort """
+    entries = []
+    try:
+        if guess is None:
+            guess = get_guess(videofile['abspath'],
+                              plugins[PluginType.guess.name],
+                              use_guess_cache(settings))
+        elif isinstance(guess, Exception):
+            raise guess
+        identificator = get_grouped_identificator(
+            guess,
+            plugins[PluginType.identificator.name],
+            ids,
+            callbacks.get('identificator'),
+            groups)
+
+        entries = get_entries(guess, identificator, plugins, paths, languages,
+                              successors)
+        store(videofile, entries, settings)
+        result['success'] = True
+
+    except SORT_ERRORS as e:
+        return failed(result, e)
+    finally:
+        finish_successors(successors, entries, result['success'])
 
     logger.debug("---- Cut here ----\n")
+    return result
+
+
+def serialize_callbacks(callbacks):
+    """ wraps the callbacks so only one thread at a time can call them """
+    lock = threading.Lock()
+
+    def wrap(callback):
+        def serialized(*args, **kwargs):
+            with lock:
+                return callback(*args, **kwargs)
+        return serialized
+
+    return {name: wrap(callbacks[name]) for name in callbacks}
+
+
+def sort_many(videofiles, plugins, ids, paths, languages, settings,
+              callbacks=None, workers=4):
+    """ sorts multiple videofiles in a threadpool and returns a result for
+    every videofile in the same order """
+
+    if callbacks:
+        callbacks = serialize_callbacks(callbacks)
+    else:
+        callbacks = {}
+
+    results = [get_result(os.path.abspath(videofile))
+               for videofile in videofiles]
+    pending = [r for r in results if not skip_processed(r, settings)]
+    guesses = get_guesses([r['videofile'] for r in pending],
+                          plugins[PluginType.guess.name],
+                          use_guess_cache(settings))
+    successors = get_successor_registry()
+    groups = get_group_registry()
+
+    def sort_one(result, guess):
+        videofile = get_videofile(result['videofile'])
+        logger.info("Processing \"{0}\"".format(videofile['abspath']))
+        try:
+            result = sort_videofile(videofile, result, plugins, ids, paths,
+                                    languages, settings, callbacks, guess,
+                                    successors, groups)
+        except Exception as e:
+            logger.exception("Sorting \"{0}\" failed".format(
+                videofile['abspath']))
+            result['error'] = e
+        remember_result(result, settings)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(sort_one, pending, guesses))
+    return results
+
+
+# async sorting
+def get_async_caller(limits):
+    """ returns a function which calls a plugin hook without blocking. the
+    async variant of the hook is used if the plugin has one, otherwise it
+    runs in a thread, like every hook called with threaded set. limits
+    contains how many calls a plugin may have in flight """
+
+    semaphores = {}
+
+    async def call(provider, hook, *args, threaded=False):
+        name = provider.__name__.split('.')[-1]
+        if name not in semaphores:
+            semaphores[name] = asyncio.Semaphore(limits.get(name, ASYNC_LIMIT))
+
+        async with semaphores[name]:
+            with httpclient.priority(PRIORITIES.get(hook,
+                                                    httpclient.METADATA)):
+                if not threaded and hasattr(provider, hook + '_async'):
+                    return await getattr(provider, hook + '_async')(*args)
+                # the thread has to know the priority of the requests
+                context = contextvars.copy_context()
+                loop = asyncio.get_event_loop()
+                return await loop.run_in_executor(
+                    None, partial(context.run, getattr(provider, hook),
+                                  *args))
+
+    return call
+
+
+async def get_identificator_async(call, guess, providers, ids, callback):
+    """ returns a identificator for a guess without blocking """
+
+    # a callback of the caller may wait for the user, so it can't run on the
+    # event loop
+    threaded = callback is not None
+    if callback is None:
+        callback = get_default_callback(guess)
+
+    identificator = get_empty_identificator(guess)
+
+    for provider in providers[guess['type'].name]:
+        logger.debug("Using {0} to get ids".format(provider.__name__))
+        try:
+            identificator.update(await call(
+                provider, 'get_identificator', guess, identificator, callback,
+                threaded=threaded
+            ))
+        except error.NotEnoughData:
+            logger.debug("{0} didn't got anything".format(provider.__name__))
+            pass
+
+    check_identificator(guess, identificator, ids)
+    return identificator
+
+
+async def get_grouped_identificator_async(call, guess, providers, ids,
+                                          callback, groups=None):
+    """ returns the same as get_grouped_identificator without blocking """
+
+    key = None
+    if groups is not None:
+        key = get_group_key(guess)
+    if key is None:
+        return await get_identificator_async(call, guess, providers, ids,
+                                             callback)
+
+    future = groups['identificators'].get(key)
+    if future is None:
+        future = asyncio.ensure_future(get_identificator_async(
+            call, guess, providers, ids, callback))
+        groups['identificators'][key] = future
+
+        def forget_failed(future):
+            if future.cancelled() or future.exception() is not None:
+                groups['identificators'].pop(key, None)
+        future.add_done_callback(forget_failed)
+    else:
+        logger.debug("Using identificator of the same group")
+
+    return fan_out(await asyncio.shield(future), guess)
+
+
+async def resolve_async(call, hook, identificator, step, languages):
+    """ resolves all types of a step of the plan in all languages at once.
+    every type uses the first value it gets in the order of languages and
+    providers """
+
+    types, rounds = step
+
+    async def call_provider(provider, providertypes, language):
+        logger.debug("Using {0}/{2} to get {1}".format(
+            provider.__name__,
+            ", ".join(providertypes),
+            language
+        ))
+        if hasattr(provider, BULK_HOOKS[hook]):
+            return await call(provider, BULK_HOOKS[hook], identificator,
+                              providertypes, language)
+        values = await asyncio.gather(
+            *[call(provider, hook, identificator, valuetype, language)
+              for valuetype in providertypes])
+        return dict(zip(providertypes, values))
+
+    async def resolve_language(language):
+        values = dict.fromkeys(types)
+
+        for providers in rounds:
+            calls = []
+            for provider, needed, providertypes in providers:
+                missing = get_missing(values, providertypes, needed,
+                                      identificator)
+                if missing:
+                    calls.append((provider, missing))
+
+            provided = await asyncio.gather(
+                *[call_provider(provider, missing, language)
+                  for provider, missing in calls])
+            for (_, missing), providervalues in zip(calls, provided):
+                for valuetype in missing:
+                    values[valuetype] = providervalues.get(valuetype)
+
+        return values
+
+    results = await asyncio.gather(
+        *[resolve_language(language) for language in languages],
+        return_exceptions=True)
+
+    def get_language(result):
+        def language():
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return language
+
+    return merge_languages(types, [get_language(r) for r in results])
+
+
+async def get_entries_async(call, guess, identificator, plugins, paths,
+                            languages, successors=None):
+    """ returns the same as get_entries without blocking """
+
+    async def get_entry(entry):
+        newIdentificator = entry['identificator']
+        plan = get_plan(plugins)[newIdentificator['type'].name]
+        entry['metadata'], entry['images'] = await asyncio.gather(
+            resolve_async(call, 'get_metadata', newIdentificator,
+                          plan['metadata'], languages['metadata']),
+            resolve_async(call, 'get_image', newIdentificator,
+                          plan['images'], languages['metadata'])
+        )
+
+    entries = []
+    try:
+        for number, newIdentificator in enumerate(
+                get_identificators(identificator)):
+            if number > 0 and \
+               not claim_successor(successors, newIdentificator):
+                logger.debug("{0} is done by another videofile".format(
+                    newIdentificator['type'].name))
+                continue
+            entries.append({
+                'guess': guess,
+                'identificator': newIdentificator,
+                'claimed': number > 0,
+            })
+        await asyncio.gather(*[get_entry(entry) for entry in entries])
+    except Exception:
+        finish_successors(successors, entries, False)
+        raise
+
+    render_paths(entries, paths)
+    return entries
+
+
+async def async_sort(videofiles, plugins, ids, paths, languages, settings,
+                     callbacks=None, limits=None, workers=64):
+    """ sorts videofiles on the running event loop and returns a result for
+    every videofile in the same order. limits contains how many requests a
+    plugin may have in flight, workers how many videofiles are sorted at
+    once """
+
+    if callbacks:
+        callbacks = serialize_callbacks(callbacks)
+    else:
+        callbacks = {}
+
+    call = get_async_caller(limits or {})
+    running = asyncio.Semaphore(workers)
+    loop = asyncio.get_event_loop()
+
+    results = [get_result(os.path.abspath(videofile))
+               for videofile in videofiles]
+    pending = [r for r in results if not skip_processed(r, settings)]
+    guesses = await loop.run_in_executor(
+        None, get_guesses, [r['videofile'] for r in pending],
+        plugins[PluginType.guess.name], use_guess_cache(settings))
+    successors = get_successor_registry()
+    groups = get_group_registry()
+
+    async def sort_one(result, guess):
+        async with running:
+            videofile = get_videofile(result['videofile'])
+
+            logger.info("Processing \"{0}\"".format(videofile['abspath']))
+
+            entries = []
+            try:
+                if isinstance(guess, Exception):
+                    raise guess
+                identificator = await get_grouped_identificator_async(
+                    call, guess, plugins[PluginType.identificator.name], ids,
+                    callbacks.get('identificator'), groups)
+                entries = await get_entries_async(
+                    call, guess, identificator, plugins, paths, languages,
+                    successors)
+                await loop.run_in_executor(
+                    None, store, videofile, entries, settings)
+            except SORT_ERRORS as e:
+                failed(result, e)
+            except Exception as e:
+                logger.exception("Sorting \"{0}\" failed".format(
+                    videofile['abspath']))
+                result['error'] = e
+            else:
+                logger.debug("---- Cut here ----\n")
+                result['success'] = True
+            finally:
+                finish_successors(successors, entries, result['success'])
+
+            remember_result(result, settings)
+
+    try:
+        await asyncio.gather(
+            *[sort_one(r, g) for r, g in zip(pending, guesses)])
+        return results
+    finally:
+        await httpclient.close_async()
@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import threading
+
 from mediasort import error
 
 from mako.template import Template
@@ -21,6 +23,18 @@ from mako import exceptions
 
 INVALID_CHARS = "?<>:*|\""
 
+# compiled templates, compiling isn't thread safe
+TEMPLATES = {}
+TEMPLATES_LOCK = threading.Lock()
+
+
+def get_template(string):
+    """ returns the compiled template of a string """
+    with TEMPLATES_LOCK:
+        if string not in TEMPLATES:
+            TEMPLATES[string] = Template(string)
+        return TEMPLATES[string]
+
 
 def get_filename_string(string):
     result = ''
@@ -40,10 +54,10 @@ def get_paths(paths, metadata):
             if path == 'template':
                 outpaths[path] = paths[path]
             elif path != 'base':
-                outpaths[path] = Template(paths['base']).render_unicode(**metadata)
-                outpaths[path] += Template(paths[path]).render_unicode(**metadata)
+                outpaths[path] = get_template(paths['base']).render_unicode(**metadata)
+                outpaths[path] += get_template(paths[path]).render_unicode(**metadata)
             elif path == 'base':
-                outpaths[path] = Template(paths[path]).render_unicode(**metadata)
+                outpaths[path] = get_template(paths[path]).render_unicode(**metadata)
         except TypeError:
             raise error.InvalidConfig(
                 "The path {0}:{1} uses a invalid object.\nAvailable objects are {2}".format(
@@ -61,7 +75,7 @@ def write_nfo(templatefile, metadata, filename):
         template = tf.read()
 
     try:
-        output = Template(template).render_unicode(**metadata)
+        output = get_template(template).render_unicode(**metadata)
     except KeyError:
         raise error.InvalidConfig(
             "The template for {0} uses a invalid object.\nAvailable objects are {1}".format(
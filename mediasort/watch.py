@@ -0,0 +1,244 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" watches folders with inotify and sorts videofiles as they land """
+
+import os
+import ctypes
+import ctypes.util
+import logging
+import select
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from mediasort import helpers, sorting
+
+# create logger
+logger = logging.getLogger('mediasort')
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event without its name
+EVENT = struct.Struct('iIII')
+
+LIBC = None
+
+
+# INTERNAL
+def get_libc():
+    """ returns the libc which provides inotify """
+    global LIBC
+    if LIBC is None:
+        LIBC = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    return LIBC
+
+
+def check(result):
+    """ raises an OSError if a libc call failed """
+    if result < 0:
+        number = ctypes.get_errno()
+        raise OSError(number, os.strerror(number))
+    return result
+
+
+def add_watches(fd, path, watches, prune):
+    """ watches a folder and all its not pruned subfolders """
+    folders = [path]
+    while folders:
+        folder = folders.pop()
+        try:
+            wd = check(get_libc().inotify_add_watch(
+                fd, os.fsencode(folder), WATCH_MASK | IN_ONLYDIR))
+        except OSError as e:
+            logger.warning("Can't watch {0}: {1}".format(folder, e))
+            continue
+        watches[wd] = folder
+        folders.extend(helpers.scan_folder(folder, [], 0, prune)[1])
+
+
+def read_events(fd):
+    """ returns mask and path relative to the watch of every pending event """
+    events = []
+    try:
+        data = os.read(fd, 65536)
+    except BlockingIOError:
+        return events
+
+    offset = 0
+    while offset < len(data):
+        wd, mask, _, length = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append((wd, mask, os.fsdecode(name)))
+    return events
+
+
+def is_ready(filepath, minsize, settle):
+    """ returns True if a file is big enough and wasn't changed for settle
+    seconds, None if it's gone or too small and False otherwise """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+    if time.time() - stat.st_mtime < settle:
+        return False
+    if stat.st_size < minsize:
+        return None
+    return True
+
+
+# MODULE
+def watch(roots, extensions, filesize, plugins, ids, paths, languages,
+          settings, callbacks=None, workers=4, settle=10.0, prune=None,
+          rescan=True, stop=None, refresh=3600.0):
+    """ sorts videofiles with given extensions and bigger than filesize as
+    soon as they land in one of the roots. a file is sorted when it wasn't
+    written for settle seconds. if rescan is set, files already in the roots
+    are sorted too. runs until stop is set. callbacks['result'] gets the
+    result of every sorted videofile. tvshows and seasons are processed
+    and the caches of the plugins kept once per batch of files sorted
+    together, but at least every refresh seconds """
+
+    if callbacks:
+        callbacks = sorting.serialize_callbacks(callbacks)
+    else:
+        callbacks = {}
+    if prune is None:
+        prune = helpers.PRUNE
+    if stop is None:
+        stop = threading.Event()
+    minsize = filesize * 1048576  # use filesize as MB
+
+    fd = check(get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+    watches = {}
+    # last event of every file which isn't sorted yet
+    pending = {}
+    running = set()
+    lock = threading.Lock()
+    # successors are done, groups identified and the caches of the plugins
+    # kept once per batch. a batch ends when nothing is sorted anymore. once
+    # it's older than refresh, new files wait until it ended
+    batch = {'created': 0.0}
+
+    def wanted(filepath):
+        return os.path.splitext(filepath)[1].lower()[1:] in extensions
+
+    def add_files(path):
+        for filepath in helpers.scan(path, extensions, 0, prune):
+            pending[filepath] = time.time()
+
+    def get_batch():
+        if running:
+            if time.time() - batch['created'] < refresh:
+                return batch
+            return None
+        sorting.clear_caches(plugins)
+        batch.update({
+            'created': time.time(),
+            'successors': sorting.get_successor_registry(),
+            'groups': sorting.get_group_registry(),
+        })
+        return batch
+
+    def sort_one(filepath, successors, groups):
+        try:
+            result = sorting.sort(filepath, plugins, ids, paths, languages,
+                                  settings, callbacks,
+                                  successors=successors, groups=groups)
+        except Exception as e:
+            logger.exception("Sorting \"{0}\" failed".format(filepath))
+            result = sorting.get_result(filepath)
+            result['error'] = e
+        finally:
+            with lock:
+                running.discard(filepath)
+        if 'result' in callbacks:
+            callbacks['result'](result)
+
+    def watch_roots():
+        for root in roots:
+            add_watches(fd, root, watches, prune)
+            if rescan:
+                add_files(root)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        watch_roots()
+
+        while not stop.is_set():
+            readable, _, _ = select.select([fd], [], [], 1.0)
+            if readable:
+                for wd, mask, name in read_events(fd):
+                    if mask & IN_Q_OVERFLOW:
+                        logger.warning("Missed inotify events, rescanning")
+                        for root in roots:
+                            add_files(root)
+                        continue
+                    if mask & IN_IGNORED:
+                        watches.pop(wd, None)
+                        continue
+                    if wd not in watches:
+                        continue
+
+                    path = os.path.join(watches[wd], name)
+                    if mask & IN_ISDIR:
+                        # folders moved in already contain their files
+                        if mask & (IN_CREATE | IN_MOVED_TO) and \
+                           not helpers.is_pruned(name, prune):
+                            add_watches(fd, path, watches, prune)
+                            add_files(path)
+                    elif wanted(path) and \
+                            (mask & (IN_CLOSE_WRITE | IN_MOVED_TO) or
+                             path in pending):
+                        pending[path] = time.time()
+
+            # dispatch the files which weren't touched for settle seconds
+            now = time.time()
+            for filepath in list(pending):
+                if now - pending[filepath] < settle:
+                    continue
+                ready = is_ready(filepath, minsize, settle)
+                if ready is False:
+                    continue
+                with lock:
+                    if ready is None or filepath in running:
+                        del pending[filepath]
+                        continue
+                    current = get_batch()
+                    if current is None:
+                        continue
+                    del pending[filepath]
+                    running.add(filepath)
+                executor.submit(sort_one, filepath, current['successors'],
+                                current['groups'])
+    finally:
+        executor.shutdown(wait=True)
+        os.close(fd)
@@ -23,12 +23,19 @@ setup(
         'guessit>=2',
         'Mako',
         'fuzzywuzzy',
+        'requests',
     ],
+    python_requires='>=3.7',
+    extras_require={
+        'async': ['aiohttp'],
+    },
     classifiers = [
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
-        "Operating System :: OS Independent",
-        "Programming Language :: Python :: 3.5",
+        "Operating System :: POSIX",
+        "Operating System :: POSIX :: Linux",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.7",
         "Topic :: Software Development :: Libraries :: Python Modules",
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)"
     ],
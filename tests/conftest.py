@@ -0,0 +1,36 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" fixtures shared by the tests """
+
+import os
+
+import pytest
+
+from mediasort import cache
+
+TESTFILES = os.path.join(os.path.dirname(__file__), '..', 'testfiles')
+
+
+@pytest.fixture(autouse=True)
+def cachedir(tmp_path, monkeypatch):
+    """ every test gets its own empty cache databases """
+    monkeypatch.setattr(cache, 'CACHEDIR', str(tmp_path / 'cache'))
+    cache.LOCAL.__dict__.clear()
+    yield str(tmp_path / 'cache')
+    for connection in cache.LOCAL.__dict__.get('connections', {}).values():
+        connection.close()
+    cache.LOCAL.__dict__.clear()
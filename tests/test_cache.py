@@ -0,0 +1,106 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" tests of the cache of web api responses """
+
+import json
+import time
+
+import pytest
+
+from mediasort import cache
+
+RESPONSE = {'id': 1}
+SIZE = len(json.dumps(RESPONSE))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ a clock which only moves when it's told to """
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    return now
+
+
+def get_keys():
+    return {key for key, in cache.get_response_connection().execute(
+        "SELECT key FROM responses")}
+
+
+def get_size():
+    """ returns the total size of the cache and checks it's the real one """
+    connection = cache.get_response_connection()
+    size = connection.execute("SELECT size FROM response_size").fetchone()[0]
+    assert size == connection.execute(
+        "SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+    return size
+
+
+def test_response_is_loaded_until_ttl(clock):
+    cache.save_response('a', 'movie', RESPONSE, 1000)
+
+    clock[0] += 59
+    assert cache.load_response('a', 'movie', 60) == RESPONSE
+    clock[0] += 2
+    assert cache.load_response('a', 'movie', 60) is None
+    assert cache.get_response_stats() == {
+        'movie': {'hits': 1, 'misses': 1}}
+
+
+def test_saving_again_renews_the_response(clock):
+    cache.save_response('a', 'movie', RESPONSE, 1000)
+    clock[0] += 100
+    cache.save_response('a', 'movie', {'id': 2}, 1000)
+
+    assert cache.load_response('a', 'movie', 60) == {'id': 2}
+    assert get_size() == SIZE
+
+
+def test_least_recently_used_responses_are_removed(clock):
+    for key in 'abc':
+        cache.save_response(key, 'movie', RESPONSE, 3 * SIZE)
+        clock[0] += 1
+    # reading a makes b the least recently used one
+    cache.load_response('a', 'movie', 60)
+    clock[0] += 1
+
+    cache.save_response('d', 'movie', RESPONSE, 3 * SIZE)
+    assert get_keys() == {'a', 'c', 'd'}
+    assert get_size() == 3 * SIZE
+
+
+def test_enough_responses_are_removed_for_a_big_one(clock):
+    for key in 'abc':
+        cache.save_response(key, 'movie', RESPONSE, 4 * SIZE)
+        clock[0] += 1
+
+    # a bigger response which needs the space of two others
+    big = {'id': 'x' * 12}
+    assert 2 * SIZE < len(json.dumps(big)) <= 3 * SIZE
+    cache.save_response('d', 'movie', big, 4 * SIZE)
+    assert get_keys() == {'c', 'd'}
+    assert get_size() <= 4 * SIZE
+
+
+def test_size_survives_a_new_connection(clock, cachedir):
+    for key in 'ab':
+        cache.save_response(key, 'movie', RESPONSE, 1000)
+    for connection in cache.LOCAL.connections.values():
+        connection.close()
+    cache.LOCAL.__dict__.clear()
+
+    assert get_size() == 2 * SIZE
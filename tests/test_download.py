@@ -0,0 +1,403 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the downloads """
+
+import collections
+import os
+import re
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from mediasort import cache, download, httpclient
+
+DATA = bytes(range(256)) * 4096
+
+
+class Handler(BaseHTTPRequestHandler):
+    """ serves DATA with an etag and honors range requests like the server
+    dict says """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server.state
+        server['requests'].append(dict(self.headers))
+
+        start = 0
+        match = re.match(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if match is not None and server['ranges']:
+            start = int(match.group(1))
+            if start >= len(DATA):
+                self.send_response(416)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if server['if_range'] and \
+               self.headers.get('If-Range') != server['etag']:
+                start = 0
+
+        body = DATA[start:]
+        self.send_response(206 if start else 200)
+        self.send_header('ETag', server['etag'])
+        if start:
+            self.send_header('Content-Range', "bytes {0}-{1}/{2}".format(
+                start, len(DATA) - 1, len(DATA)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Server(ThreadingHTTPServer):
+    """ a server which doesn't complain about clients which hang up before
+    they got everything """
+
+    def handle_error(self, request, client_address):
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+@pytest.fixture
+def server():
+    """ returns the state and base url of a local http server """
+    httpd = Server(('127.0.0.1', 0), Handler)
+    httpd.state = {'etag': '"v1"', 'ranges': True, 'if_range': True,
+                   'requests': []}
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    config = dict(httpclient.CONFIG)
+    httpclient.init({'retries': 0})
+    yield httpd.state, "http://127.0.0.1:{0}/".format(httpd.server_port)
+    httpd.shutdown()
+    httpd.server_close()
+    httpclient.init(config)
+
+
+@pytest.fixture
+def media(tmp_path):
+    """ returns an empty folder for the downloaded files """
+    folder = tmp_path / 'media'
+    folder.mkdir()
+    return folder
+
+
+def interrupt(destination, url, received, etag='"v1"'):
+    """ leaves an unfinished download like an interrupted one would """
+    temp = download.get_temp_path(destination)
+    with open(temp, 'wb') as local:
+        local.write(DATA[:received])
+    cache.save_download(destination, {'url': url, 'temp': temp,
+                                       'received': received, 'etag': etag,
+                                       'modified': None})
+    return temp
+
+
+def read(path):
+    with open(path, 'rb') as local:
+        return local.read()
+
+
+# RESUME
+def test_fetch_continues_with_range(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    temp = interrupt(destination, base + 'poster.jpg', 1000)
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    assert state['requests'][-1]['Range'] == 'bytes=1000-'
+    assert state['requests'][-1]['If-Range'] == '"v1"'
+    assert read(path) == DATA
+    assert not os.path.exists(temp)
+    assert cache.load_download(destination) is None
+
+
+def test_fetch_starts_over_if_the_file_changed(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    interrupt(destination, base + 'poster.jpg', 1000)
+    state['etag'] = '"v2"'
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    assert len(state['requests']) == 1
+    assert read(path) == DATA
+    assert os.listdir(str(media)) == ['poster.jpg']
+
+
+def test_fetch_starts_over_if_server_ignores_if_range(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    interrupt(destination, base + 'poster.jpg', 1000, etag='"v0"')
+    state['if_range'] = False
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    # the range of another version is thrown away and fetched again
+    assert len(state['requests']) == 2
+    assert 'Range' not in state['requests'][-1]
+    assert read(path) == DATA
+
+
+def test_fetch_starts_over_if_server_ignores_ranges(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    interrupt(destination, base + 'poster.jpg', 1000)
+    state['ranges'] = False
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    assert len(state['requests']) == 1
+    assert read(path) == DATA
+
+
+def test_fetch_starts_over_if_range_not_satisfiable(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    interrupt(destination, base + 'poster.jpg', len(DATA))
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    assert [r.get('Range') for r in state['requests']] == \
+        ["bytes={0}-".format(len(DATA)), None]
+    assert read(path) == DATA
+    assert cache.load_download(destination) is None
+
+
+def test_fetch_trusts_only_the_journal(server, media):
+    state, base = server
+    destination = str(media / 'poster')
+    temp = interrupt(destination, base + 'poster.jpg', 1000)
+    # written after the journal was updated the last time
+    with open(temp, 'ab') as local:
+        local.write(b'garbage')
+
+    path = download.fetch(base + 'poster.jpg', destination)
+
+    assert state['requests'][-1]['Range'] == 'bytes=1000-'
+    assert read(path) == DATA
+
+
+# STORE
+@pytest.fixture
+def blob(tmp_path):
+    """ returns a stored file """
+    path = tmp_path / 'blob.jpg'
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def test_place_hardlinks(blob, media):
+    download.place(blob, str(media / 'poster.jpg'))
+
+    assert os.path.samefile(blob, str(media / 'poster.jpg'))
+
+
+def test_place_reflinks_without_hardlinks(blob, media, monkeypatch):
+    def link(source, path):
+        raise OSError("Invalid cross-device link")
+    reflinked = []
+
+    def reflink(source, path):
+        reflinked.append(source)
+        with open(path, 'xb') as local:
+            local.write(read(source))
+    monkeypatch.setattr(os, 'link', link)
+    monkeypatch.setattr(download, 'reflink', reflink)
+
+    download.place(blob, str(media / 'poster.jpg'))
+
+    assert reflinked == [blob]
+    assert read(str(media / 'poster.jpg')) == DATA
+
+
+def test_place_copies_without_links(blob, media, monkeypatch):
+    def fail(source, path):
+        raise OSError("Operation not supported")
+    monkeypatch.setattr(os, 'link', fail)
+    monkeypatch.setattr(download, 'reflink', fail)
+
+    download.place(blob, str(media / 'poster.jpg'))
+
+    assert not os.path.samefile(blob, str(media / 'poster.jpg'))
+    assert read(str(media / 'poster.jpg')) == DATA
+    assert os.listdir(str(media)) == ['poster.jpg']
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """ turns on the store for a test """
+    folder = str(tmp_path / 'store')
+    monkeypatch.setitem(download.CONFIG, 'store', folder)
+    monkeypatch.setattr(download, 'DOWNLOADED', [])
+    return folder
+
+
+needs_flock = pytest.mark.skipif(download.fcntl is None,
+                                 reason="needs flock")
+
+
+@needs_flock
+def test_store_downloads_every_url_once(server, media, store):
+    state, base = server
+
+    for name in ('poster', 'season1'):
+        download.download(base + 'poster.jpg', str(media / name))
+
+    assert len(state['requests']) == 1
+    assert os.path.samefile(str(media / 'poster.jpg'),
+                            str(media / 'season1.jpg'))
+    # the lock files are gone
+    assert os.listdir(os.path.join(store, 'locks')) == []
+
+
+@needs_flock
+def test_prune_store_removes_unlinked_images(server, media, store):
+    state, base = server
+    download.download(base + 'poster.jpg', str(media / 'poster'))
+    download.download(base + 'fanart.jpg', str(media / 'fanart'))
+    os.remove(str(media / 'fanart.jpg'))
+
+    download.prune_store()
+
+    blobs = [f for root, _, files in os.walk(store) for f in files
+             if f.endswith('.jpg')]
+    # both urls have the same content, which is still linked
+    assert len(blobs) == 1
+    os.remove(str(media / 'poster.jpg'))
+    download.prune_store()
+    assert cache.load_blob(base + 'poster.jpg') is None
+    assert not any(f.endswith('.jpg') for root, _, files in os.walk(store)
+                   for f in files)
+
+
+@needs_flock
+def test_prune_store_keeps_everything_but_images(server, media, store):
+    state, base = server
+    download.download(base + 'poster.jpg', str(media / 'poster'))
+    os.remove(str(media / 'poster.jpg'))
+    digest = cache.load_blob(base + 'poster.jpg')[0]
+    folder = os.path.join(store, digest[:2])
+    others = [os.path.join(folder, '0' * 64 + '.jpg'),
+              os.path.join(folder, 'notes.txt'),
+              os.path.join(store, 'partial.jpg')]
+    for other in others:
+        with open(other, 'w'):
+            pass
+    # a folder named like an image
+    os.mkdir(os.path.join(folder, digest[:2] + '0' * 62 + '.png'))
+
+    download.prune_store()
+
+    assert sorted(os.listdir(folder)) == sorted(
+        [digest[:2] + '0' * 62 + '.png', '0' * 64 + '.jpg', 'notes.txt'])
+    assert all(os.path.exists(other) for other in others)
+
+
+# QUEUE
+@pytest.fixture
+def downloads(monkeypatch):
+    """ replaces the downloads by ones which wait until they are released.
+    returns the running urls, the release event and the most downloads
+    which ran at once per host """
+    running = []
+    lock = threading.Lock()
+    release = threading.Event()
+    state = {'running': running, 'release': release, 'most': {}}
+
+    def fake_download(url, destination):
+        host = url.split('/')[2]
+        with lock:
+            running.append(url)
+            count = len([r for r in running if r.split('/')[2] == host])
+            state['most'][host] = max(state['most'].get(host, 0), count)
+        release.wait(5)
+        with lock:
+            running.remove(url)
+
+    monkeypatch.setattr(download, 'download', fake_download)
+    monkeypatch.setitem(download.CONFIG, 'workers', 8)
+    monkeypatch.setitem(download.CONFIG, 'per_host', 2)
+    monkeypatch.setattr(download, 'EXECUTOR', None)
+    monkeypatch.setattr(download, 'QUEUED', {})
+    monkeypatch.setattr(download, 'HOSTS', {})
+    yield state
+    release.set()
+    if download.EXECUTOR is not None:
+        download.EXECUTOR.shutdown(wait=True)
+
+
+def wait_running(downloads, count):
+    """ waits until count downloads run """
+    deadline = time.monotonic() + 5
+    while len(downloads['running']) < count:
+        assert time.monotonic() < deadline, "Downloads didn't start"
+        time.sleep(0.01)
+
+
+def queue(host, count):
+    return [download.queue("http://{0}/{1}.jpg".format(host, number),
+                           "{0}{1}".format(host, number))
+            for number in range(count)]
+
+
+def test_queue_limits_downloads_per_host(downloads):
+    futures = queue('busy', 6)
+    wait_running(downloads, 2)
+
+    # a busy host doesn't hold up the others
+    futures += queue('idle', 2)
+    wait_running(downloads, 4)
+    assert sorted(downloads['running'])[2:] == ['http://idle/0.jpg',
+                                                'http://idle/1.jpg']
+
+    downloads['release'].set()
+    download.wait(futures)
+    # the futures are done before the downloads are counted as finished
+    download.EXECUTOR.shutdown(wait=True)
+    assert downloads['most'] == {'busy': 2, 'idle': 2}
+    assert download.HOSTS['busy'] == {'running': 0,
+                                      'waiting': collections.deque()}
+
+
+def test_queued_destination_shares_its_future(downloads):
+    first = download.queue("http://host/poster.jpg", "poster")
+    assert download.queue("http://host/poster.jpg", "poster") is first
+
+    downloads['release'].set()
+    download.wait([first])
+    # a finished download can be queued again
+    assert download.queue("http://host/poster.jpg", "poster") is not first
+
+
+def test_failed_download_starts_the_next_one(downloads, monkeypatch):
+    def fail(url, destination):
+        raise OSError("Disk full")
+
+    monkeypatch.setattr(download, 'download', fail)
+    futures = queue('host', 4)
+
+    with pytest.raises(OSError):
+        download.wait(futures)
+    assert all(future.exception() for future in futures)
+    download.EXECUTOR.shutdown(wait=True)
+    assert download.HOSTS['host']['running'] == 0
@@ -0,0 +1,97 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the images of fanart.tv """
+
+import asyncio
+
+import pytest
+import requests
+
+from mediasort.enums import MediaType
+from mediasort.plugins import fanarttv
+
+MOVIE = {'type': MediaType.movie, 'tmdb': 1}
+IMAGES = {
+    'movielogo': [{'lang': 'de', 'url': 'logo.de'},
+                  {'lang': 'en', 'url': 'logo.en'}],
+    'movieposter': [{'lang': '00', 'url': 'poster'}],
+}
+
+
+def get_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(response=response)
+
+
+@pytest.fixture
+def fanart(monkeypatch):
+    """ fanart.tv answers the async requests with the answers in the
+    returned list, the sync requests must not be used """
+    answers = []
+
+    def get_json(url, params=None):
+        raise AssertionError("Blocking request of " + url)
+
+    async def get_json_async(url, params=None):
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(fanarttv.httpclient, 'get_json', get_json)
+    monkeypatch.setattr(fanarttv.httpclient, 'get_json_async',
+                        get_json_async)
+    monkeypatch.setattr(fanarttv, 'CONFIG', {'key': 'key'})
+    fanarttv.clear_cache()
+    yield answers
+    fanarttv.clear_cache()
+
+
+def test_image_has_the_language_or_none():
+    assert fanarttv.select_image(IMAGES, ['hdmovielogo', 'movielogo'],
+                                 'en') == 'logo.en'
+    assert fanarttv.select_image(IMAGES, ['movieposter'], 'en') == 'poster'
+    assert fanarttv.select_image(IMAGES, ['movielogo'], 'fr') is None
+    assert fanarttv.select_image([], ['movielogo'], 'en') is None
+
+
+def test_images_are_requested_async(fanart):
+    fanart.append(IMAGES)
+
+    assert asyncio.run(fanarttv.get_image_async(MOVIE, 'logo',
+                                                'en')) == 'logo.en'
+    assert asyncio.run(fanarttv.get_images_bulk_async(
+        MOVIE, ['logo', 'poster', 'disc'], 'de')) == {
+            'logo': 'logo.de', 'poster': 'poster', 'disc': None}
+    assert not fanart
+
+
+@pytest.mark.parametrize('status', [404, 500])
+def test_failed_request_doesnt_block(fanart, status):
+    fanart.append(get_error(status))
+
+    assert asyncio.run(fanarttv.get_image_async(MOVIE, 'logo', 'en')) is None
+
+
+def test_only_missing_images_are_cached(fanart):
+    fanart.extend([get_error(500), IMAGES])
+
+    assert asyncio.run(fanarttv.get_images_bulk_async(
+        MOVIE, ['poster'], 'en')) == {'poster': None}
+    assert asyncio.run(fanarttv.get_images_bulk_async(
+        MOVIE, ['poster'], 'en')) == {'poster': 'poster'}
@@ -0,0 +1,105 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the filename guesses """
+
+import glob
+import os
+
+import pytest
+
+from mediasort import error
+from mediasort.enums import MediaType
+from mediasort.plugins import filename
+
+from conftest import TESTFILES
+
+FIELDS = ['type', 'title', 'year', 'season', 'episode', 'releasegroup']
+
+VIDEOFILES = sorted(glob.glob(os.path.join(TESTFILES, '*', '*', '*.mkv')))
+
+
+@pytest.fixture
+def guess():
+    """ returns a function guessing a filepath with or without the fast
+    path """
+    def guess(filepath, fast):
+        filename.init({'fast': fast})
+        return filename.get_guess(filepath)
+    yield guess
+    filename.init(None)
+
+
+@pytest.mark.parametrize('filepath', VIDEOFILES,
+                         ids=lambda f: os.path.relpath(f, TESTFILES))
+def test_fast_guess_equals_guessit(guess, filepath):
+    plain = guess(filepath, False)
+    fast = guess(filepath, True)
+    assert {f: fast.get(f) for f in FIELDS} == \
+        {f: plain.get(f) for f in FIELDS}
+
+
+def test_fast_guess_of_movie():
+    fast = filename.get_fast_guess("The.Movie.2010.1080p.BluRay.x264-GRP")
+    assert fast['type'] == MediaType.movie
+    assert fast['title'] == "The Movie"
+    assert fast['year'].year == 2010
+    assert fast['releasegroup'] == "GRP"
+
+
+def test_fast_guess_of_episode():
+    fast = filename.get_fast_guess("The.Show.S02E05.720p.HDTV.x264-GRP")
+    assert fast['type'] == MediaType.episode
+    assert fast['title'] == "The Show"
+    assert (fast['season'], fast['episode']) == (2, 5)
+
+
+@pytest.mark.parametrize('name', [
+    "Kill.Bill.Vol.1.2003.German.DTS.1080p.BluRay.x264-SightHD",
+    "Movie.2010.1080p.BluRay.x264-RSG{{m7q3qMBbrb}}",
+    "Blade.Runner.2049.2017.1080p.BluRay.x264-GRP",
+    "Doctor.Who.2005.S01E01.720p.HDTV.x264-GRP",
+    "The.Office.US.S01E01.720p.HDTV.x264-GRP",
+    "Movie.Title.Extended.2010.1080p.BluRay.x264-GRP",
+    "Movie.Title.Directors.Cut.2010.1080p.BluRay.x264-GRP",
+    "Movie.Title.Unrated.2010.1080p.BluRay.x264-GRP",
+    "Title.3D.2010.1080p.BluRay.x264-GRP",
+    "no release name",
+])
+def test_fast_guess_leaves_ambiguous_names_to_guessit(name):
+    assert filename.get_fast_guess(name) is None
+
+
+def test_failed_file_doesnt_fail_its_batch(monkeypatch):
+    def guessit(filepath):
+        raise ValueError("guessit broke")
+    monkeypatch.setattr(filename, 'guessit', guessit)
+
+    assert isinstance(filename.get_guess_or_error("a.mkv"), error.GuessError)
+
+
+def test_pool_doesnt_fork(monkeypatch):
+    monkeypatch.setattr(filename, 'POOL', None)
+    filename.init({'processes': 1})
+    pool = filename.get_pool()
+    try:
+        guesses = filename.get_guesses(VIDEOFILES[:2])
+        assert pool._mp_context.get_start_method() == 'forkserver'
+    finally:
+        pool.shutdown()
+        filename.init(None)
+
+    assert [g['filepath'] for g in guesses] == VIDEOFILES[:2]
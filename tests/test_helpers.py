@@ -0,0 +1,71 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" tests of the helpers """
+
+import os
+
+import pytest
+
+from mediasort import helpers
+
+EXTENSIONS = ['mkv']
+
+
+@pytest.fixture
+def media(tmp_path):
+    """ returns a folder with videofiles, one of them in a sample folder """
+    for name in ['movie/movie.mkv', 'movie/Sample/sample.mkv',
+                 'tv/show/episode.mkv', 'tv/show/episode.nfo']:
+        path = tmp_path / 'media' / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'video')
+    return tmp_path / 'media'
+
+
+def get_names(filepaths):
+    return sorted(os.path.basename(filepath) for filepath in filepaths)
+
+
+def test_scan_prunes_samples(media):
+    assert get_names(helpers.scan(str(media), EXTENSIONS, 0)) == \
+        ['episode.mkv', 'movie.mkv']
+
+
+def test_find_prunes_nothing_by_default(media):
+    assert get_names(helpers.find(str(media), EXTENSIONS, 0)) == \
+        ['episode.mkv', 'movie.mkv', 'sample.mkv']
+    assert get_names(helpers.find(str(media), EXTENSIONS, 0,
+                                  helpers.PRUNE)) == \
+        ['episode.mkv', 'movie.mkv']
+
+
+def test_scan_many_finds_files_once(media, tmp_path):
+    os.symlink(str(media / 'tv'), str(tmp_path / 'tv'))
+    roots = [str(media / 'tv'), str(media), str(media / 'tv' / 'show'),
+             str(tmp_path / 'tv'), str(media / 'movie' / 'movie.mkv')]
+
+    assert get_names(helpers.scan_many(roots, EXTENSIONS, 0)) == \
+        ['episode.mkv', 'movie.mkv']
+
+
+def test_scan_many_keeps_roots_next_to_each_other(media, tmp_path):
+    os.rename(str(media / 'tv'), str(tmp_path / 'media-tv'))
+    roots = [str(media), str(tmp_path / 'media-tv')]
+
+    assert get_names(helpers.scan_many(roots, EXTENSIONS, 0)) == \
+        ['episode.mkv', 'movie.mkv']
@@ -0,0 +1,190 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the scheduling of requests """
+
+import asyncio
+import io
+import threading
+import time
+
+import pytest
+import requests
+
+from mediasort import httpclient
+
+HOST = 'limited.test'
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    """ HOST gets 20 requests per second without burst, other hosts have no
+    limit """
+    monkeypatch.setitem(httpclient.CONFIG, 'limits', {HOST: [20, 1]})
+    monkeypatch.setitem(httpclient.CONFIG, 'retries', 3)
+    httpclient.BUCKETS.clear()
+    yield httpclient.BUCKETS
+    httpclient.BUCKETS.clear()
+
+
+def get_response(status, retry):
+    response = requests.Response()
+    response.status_code = status
+    response.headers['Retry-After'] = retry
+    response.raw = io.BytesIO(b'')
+    return response
+
+
+def wait_queued(host, count):
+    """ waits until count requests wait for host """
+    bucket = httpclient.get_bucket(host)
+    while True:
+        with bucket['condition']:
+            if len(bucket['waiting']) >= count:
+                return
+        time.sleep(0.001)
+
+
+def test_higher_priority_goes_first(buckets):
+    order = []
+
+    def request(level):
+        with httpclient.priority(level):
+            httpclient.acquire(HOST)
+        order.append(level)
+
+    # the only token is used, the others have to wait
+    httpclient.acquire(HOST)
+    threads = []
+    for number, level in enumerate([httpclient.IMAGES, httpclient.METADATA,
+                                    httpclient.IDENTIFICATION]):
+        threads.append(threading.Thread(target=request, args=(level,)))
+        threads[-1].start()
+        wait_queued(HOST, number + 1)
+    for thread in threads:
+        thread.join()
+
+    assert order == [httpclient.IDENTIFICATION, httpclient.METADATA,
+                     httpclient.IMAGES]
+
+
+def test_higher_priority_goes_first_async(buckets):
+    order = []
+
+    async def request(level):
+        await httpclient.acquire_async(HOST)
+        order.append(level)
+
+    async def main():
+        await httpclient.acquire_async(HOST)
+        tasks = []
+        for level in [httpclient.IMAGES, httpclient.METADATA,
+                      httpclient.IDENTIFICATION]:
+            with httpclient.priority(level):
+                tasks.append(asyncio.ensure_future(request(level)))
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+
+    assert order == [httpclient.IDENTIFICATION, httpclient.METADATA,
+                     httpclient.IMAGES]
+
+
+def test_rate_is_kept(buckets):
+    start = time.monotonic()
+    for _ in range(5):
+        httpclient.acquire(HOST)
+
+    # the first token is there, the others come every 50ms
+    assert time.monotonic() - start >= 0.19
+
+
+def test_cancelled_request_stops_waiting(buckets):
+    async def main():
+        await httpclient.acquire_async(HOST)
+        task = asyncio.ensure_future(httpclient.acquire_async(HOST))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+
+    assert not httpclient.get_bucket(HOST)['waiting']
+
+
+@pytest.mark.parametrize('acquire', ['sync', 'async'])
+def test_throttled_host_waits(buckets, acquire):
+    host = 'unlimited.test'
+    httpclient.throttle(host, 0.1)
+
+    start = time.monotonic()
+    if acquire == 'sync':
+        httpclient.acquire(host)
+    else:
+        asyncio.run(httpclient.acquire_async(host))
+
+    assert time.monotonic() - start >= 0.09
+    # other hosts don't wait
+    start = time.monotonic()
+    httpclient.acquire('other.test')
+    assert time.monotonic() - start < 0.05
+
+
+def test_retry_after_is_used(monkeypatch):
+    monkeypatch.setitem(httpclient.CONFIG, 'backoff', 1.0)
+    monkeypatch.setattr(httpclient.random, 'uniform', lambda a, b: 1.0)
+
+    assert httpclient.get_delay({'Retry-After': '2'}, 0) == 2.0
+    assert httpclient.get_delay({'Retry-After': '-1'}, 0) == 0.0
+    assert httpclient.get_delay(
+        {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 0) == 0.0
+    # without it the backoff doubles every attempt
+    assert httpclient.get_delay({'Retry-After': 'soon'}, 0) == 1.0
+    assert httpclient.get_delay({}, 2) == 4.0
+
+
+def test_throttled_request_is_retried(buckets, monkeypatch):
+    statuses = [429, 503, 200]
+    made = []
+
+    def request(self, method, url, **kwargs):
+        made.append(time.monotonic())
+        return get_response(statuses[len(made) - 1], '0.05')
+
+    monkeypatch.setattr(requests.Session, 'request', request)
+
+    response = httpclient.KeepAliveSession().get('http://unlimited.test/')
+
+    assert response.status_code == 200
+    assert len(made) == 3
+    assert made[2] - made[0] >= 0.09
+
+
+def test_throttled_request_gives_up(buckets, monkeypatch):
+    monkeypatch.setitem(httpclient.CONFIG, 'retries', 1)
+    made = []
+
+    def request(self, method, url, **kwargs):
+        made.append(url)
+        return get_response(429, '0')
+
+    monkeypatch.setattr(requests.Session, 'request', request)
+
+    response = httpclient.KeepAliveSession().get('http://unlimited.test/')
+
+    assert response.status_code == 429
+    assert len(made) == 2
@@ -0,0 +1,124 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" tests of the sorting pipeline """
+
+import queue
+import threading
+import time
+
+import pytest
+
+from mediasort import error, pipeline
+
+
+def get_job(name):
+    return {'videofile': {'abspath': name},
+            'result': {'videofile': name, 'success': False,
+                       'skipped': False, 'error': None}}
+
+
+def drain(source):
+    """ returns everything in a queue up to the end marker """
+    items = []
+    while True:
+        item = source.get(timeout=5)
+        if item is pipeline.END:
+            return items
+        items.append(item)
+
+
+def wait_for(threads):
+    for thread in threads:
+        thread.join(timeout=5)
+    return not any(thread.is_alive() for thread in threads)
+
+
+def run_pipeline(monkeypatch, names, *functions):
+    """ returns the results of a pipeline of the stage functions """
+    stages = [('stage{0}'.format(i), f) for i, f in enumerate(functions)]
+    monkeypatch.setattr(pipeline, 'STAGES', stages)
+    return pipeline.sort_pipeline(names, {}, None, None, None, {},
+                                  workers={name: 3 for name, _ in stages})
+
+
+def succeed(job, context):
+    job['result']['success'] = True
+
+
+def test_stage_passes_every_job_and_one_end():
+    source, target = queue.Queue(), queue.Queue()
+    for i in range(20):
+        source.put(get_job(str(i)))
+    source.put(pipeline.END)
+
+    threads = pipeline.run_stage('test', lambda job, context: None, source,
+                                 target, 4, {}, threading.Event())
+
+    assert sorted(int(job['videofile']['abspath'])
+                  for job in drain(target)) == list(range(20))
+    assert wait_for(threads)
+    # the end marker is put back for the siblings, only one is passed on
+    assert target.empty()
+
+
+def test_end_reaches_the_last_stage(monkeypatch):
+    seen = []
+
+    def record(job, context):
+        seen.append(job['videofile']['abspath'])
+
+    names = ['/media/{0}.mkv'.format(i) for i in range(10)]
+    results = list(run_pipeline(monkeypatch, names, record, record, succeed))
+
+    assert sorted(r['videofile'] for r in results) == names
+    assert all(r['success'] for r in results)
+    assert len(seen) == 20
+
+
+@pytest.mark.parametrize('exception', [error.NotEnoughData, ValueError])
+def test_failed_job_skips_the_next_stages(monkeypatch, exception):
+    seen = []
+
+    def fail(job, context):
+        if 'bad' in job['videofile']['abspath']:
+            raise exception("failed")
+
+    def record(job, context):
+        seen.append(job['videofile']['abspath'])
+        succeed(job, context)
+
+    results = {r['videofile']: r for r in run_pipeline(
+        monkeypatch, ['/media/good.mkv', '/media/bad.mkv'], fail, record)}
+
+    assert seen == ['/media/good.mkv']
+    assert results['/media/good.mkv']['success']
+    assert isinstance(results['/media/bad.mkv']['error'], exception)
+
+
+def test_closing_the_results_stops_every_stage(monkeypatch):
+    def slow(job, context):
+        time.sleep(0.01)
+        succeed(job, context)
+
+    before = set(threading.enumerate())
+    names = ['/media/{0}.mkv'.format(i) for i in range(1000)]
+    results = run_pipeline(monkeypatch, names, slow, slow)
+    next(results)
+    results.close()
+
+    assert wait_for(set(threading.enumerate()) - before)
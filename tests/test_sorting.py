@@ -0,0 +1,427 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the sorting """
+
+import asyncio
+import os
+import re
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from mediasort import cache, error, sorting
+from mediasort.enums import MediaType
+
+SEASON = {'type': MediaType.season, 'tmdb': 1, 'season': 2}
+
+
+# SUCCESSORS
+def claim_at_once(registry, identificator, threads=16):
+    """ returns what every thread got when claiming at the same time """
+    barrier = threading.Barrier(threads)
+
+    def claim(_):
+        barrier.wait()
+        return sorting.claim_successor(registry, identificator)
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(claim, range(threads)))
+
+
+def test_only_one_thread_claims_a_successor():
+    registry = sorting.get_successor_registry()
+
+    claims = claim_at_once(registry, SEASON)
+
+    assert claims.count(True) == 1
+
+
+def test_claims_never_wait():
+    registry = sorting.get_successor_registry()
+    assert sorting.claim_successor(registry, SEASON)
+
+    # another videofile skips it while it's processed
+    assert not sorting.claim_successor(registry, SEASON)
+
+
+def test_released_successor_can_be_claimed_again():
+    registry = sorting.get_successor_registry()
+    sorting.claim_successor(registry, SEASON)
+
+    sorting.finish_successors(
+        registry, [{'identificator': SEASON, 'claimed': True}], False)
+
+    assert claim_at_once(registry, SEASON).count(True) == 1
+
+
+def test_done_successor_isnt_claimed_again():
+    registry = sorting.get_successor_registry()
+    sorting.claim_successor(registry, SEASON)
+
+    sorting.finish_successors(
+        registry, [{'identificator': SEASON, 'claimed': True}], True)
+
+    assert claim_at_once(registry, SEASON).count(True) == 0
+    assert registry['running'] == set()
+
+
+def test_seasons_are_claimed_separately():
+    registry = sorting.get_successor_registry()
+
+    assert sorting.claim_successor(registry, SEASON)
+    assert sorting.claim_successor(registry, dict(SEASON, season=3))
+    assert sorting.claim_successor(
+        registry, {'type': MediaType.tvshow, 'tmdb': 1})
+
+
+def test_successors_without_id_are_always_claimed():
+    registry = sorting.get_successor_registry()
+    season = dict(SEASON, tmdb=None)
+
+    assert claim_at_once(registry, season).count(True) == 16
+
+
+# INCREMENTAL
+@pytest.fixture
+def videofile(tmp_path):
+    """ returns the path of a videofile """
+    path = tmp_path / 'movie.mkv'
+    path.write_bytes(b'video')
+    return str(path)
+
+
+def get_settings(**incremental):
+    return {'incremental': dict({'enabled': True, 'retry': 100,
+                                 'retry_max': 1000}, **incremental)}
+
+
+@pytest.fixture
+def skipped(monkeypatch):
+    """ returns a function which returns if the videofile is skipped after
+    seconds """
+    now = time.time()
+
+    def skipped(videofile, settings, after=0):
+        monkeypatch.setattr(time, 'time', lambda: now + after)
+        return sorting.skip_processed(sorting.get_result(videofile),
+                                      settings)
+    return skipped
+
+
+def fail(videofile, times):
+    for _ in range(times):
+        cache.save_processed(videofile, 'failed')
+
+
+def test_nothing_is_skipped_without_incremental(videofile, skipped):
+    cache.save_processed(videofile, 'sorted')
+
+    assert not skipped(videofile, {})
+    assert not skipped(videofile, get_settings(force=True))
+
+
+def test_sorted_videofile_is_skipped(videofile, skipped):
+    cache.save_processed(videofile, 'sorted')
+
+    assert skipped(videofile, get_settings())
+    assert skipped(videofile, get_settings(), after=10 ** 6)
+
+
+def test_changed_videofile_isnt_skipped(videofile, skipped):
+    cache.save_processed(videofile, 'sorted')
+    with open(videofile, 'ab') as video:
+        video.write(b'more')
+
+    assert not skipped(videofile, get_settings())
+
+
+@pytest.mark.parametrize('failures, backoff', [
+    (1, 100),
+    (2, 200),
+    (3, 400),
+    # capped by retry_max
+    (5, 1000),
+])
+def test_failed_videofile_backs_off(videofile, skipped, failures,
+                                    backoff):
+    fail(videofile, failures)
+
+    assert skipped(videofile, get_settings(), after=backoff - 1)
+    assert not skipped(videofile, get_settings(), after=backoff + 1)
+
+
+def test_sorting_resets_the_failures(videofile):
+    fail(videofile, 3)
+    cache.save_processed(videofile, 'sorted')
+    fail(videofile, 1)
+
+    assert cache.load_processed(videofile)['attempts'] == 1
+
+
+# ASYNC
+IDS = {'wanted': {'episode': ['tmdb']}}
+SETTINGS = {'cache': {'guesses': False}}
+
+
+def get_plugin(name, **hooks):
+    """ returns a plugin module with the given hooks """
+    plugin = types.ModuleType('mediasort.plugins.' + name)
+    plugin.__dict__.update(hooks)
+    return plugin
+
+
+def guess_episode(filepath):
+    """ guesses names like title.s01e02.mkv """
+    match = re.match(r'(\w+)\.s(\d+)e(\d+)', os.path.basename(filepath))
+    if match is None:
+        raise error.NotEnoughData("Not an episode")
+    return {'filepath': filepath, 'type': MediaType.episode,
+            'title': match.group(1), 'season': int(match.group(2)),
+            'episode': int(match.group(3))}
+
+
+def get_plugins(identificator):
+    return {'guess': [get_plugin('guess', get_guess=guess_episode)],
+            'identificator': {'episode': [identificator]}}
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """ records the identificators of the stored videofiles instead of
+    getting metadata and writing anything """
+    stored = {}
+
+    def get_entries(guess, identificator, *args):
+        return [{'identificator': identificator}]
+
+    async def get_entries_async(call, guess, identificator, *args):
+        return get_entries(guess, identificator)
+
+    def store(videofile, entries, settings):
+        stored[videofile['basename']] = entries[0]['identificator']
+
+    monkeypatch.setattr(sorting, 'get_entries', get_entries)
+    monkeypatch.setattr(sorting, 'get_entries_async', get_entries_async)
+    monkeypatch.setattr(sorting, 'store', store)
+    return stored
+
+
+def async_sort(names, plugins, **kwargs):
+    return asyncio.run(sorting.async_sort(names, plugins, IDS, None, None,
+                                          SETTINGS, **kwargs))
+
+
+def test_async_sort_returns_results_in_order(stored):
+    calls = []
+
+    async def get_identificator_async(guess, identificator, callback):
+        calls.append(guess['title'])
+        await asyncio.sleep(0.01)
+        return {'tmdb': len(guess['title'])}
+
+    names = ['show.s01e01.mkv', 'junk.mkv', 'other.s02e01.mkv',
+             'show.s01e02.mkv']
+    results = async_sort(names, get_plugins(get_plugin(
+        'tmdb', get_identificator_async=get_identificator_async)))
+
+    assert [os.path.basename(r['videofile']) for r in results] == names
+    assert [r['success'] for r in results] == [True, False, True, True]
+    assert isinstance(results[1]['error'], error.NotEnoughData)
+    # every tvshow is identified once, every episode keeps its own values
+    assert sorted(calls) == ['other', 'show']
+    assert stored['show.s01e02.mkv']['episode'] == 2
+    assert stored['other.s02e01.mkv']['season'] == 2
+
+
+def test_async_sort_limits_calls_per_plugin(stored):
+    running = {'now': 0, 'most': 0}
+
+    async def get_identificator_async(guess, identificator, callback):
+        running['now'] += 1
+        running['most'] = max(running['most'], running['now'])
+        await asyncio.sleep(0.01)
+        running['now'] -= 1
+        return {'tmdb': 1}
+
+    names = ['{0}.s01e01.mkv'.format(title) for title in 'abcdef']
+    plugins = get_plugins(get_plugin(
+        'tmdb', get_identificator_async=get_identificator_async))
+
+    async_sort(names, plugins, limits={'tmdb': 2})
+    assert running['most'] == 2
+
+
+def test_async_sort_runs_callbacks_of_the_caller_in_threads(stored):
+    threads = []
+
+    def get_identificator(guess, identificator, callback):
+        threads.append(threading.current_thread())
+        return {'tmdb': callback([], guess['title'])}
+
+    async def get_identificator_async(guess, identificator, callback):
+        pytest.fail("a callback of the caller ran on the event loop")
+
+    plugins = get_plugins(get_plugin(
+        'tmdb', get_identificator=get_identificator,
+        get_identificator_async=get_identificator_async))
+
+    results = async_sort(['show.s01e01.mkv'], plugins,
+                         callbacks={'identificator': lambda *args: 7})
+    assert results[0]['success']
+    assert threads[0] is not threading.main_thread()
+
+
+# GUESSES
+def test_failed_guess_is_the_error_of_its_file():
+    def get_guess(filepath):
+        if 'broken' in filepath:
+            raise ValueError("broken")
+        return guess_episode(filepath)
+
+    guesses = sorting.get_guesses(
+        ['show.s01e01.mkv', 'broken.s01e02.mkv', 'junk.mkv'],
+        [get_plugin('guess', get_guess=get_guess)])
+
+    assert guesses[0]['episode'] == 1
+    assert isinstance(guesses[1], ValueError)
+    assert isinstance(guesses[2], error.NotEnoughData)
+
+
+def test_failed_batch_is_guessed_one_file_at_a_time():
+    def get_guesses(filepaths):
+        raise RuntimeError("the pool broke")
+
+    guesses = sorting.get_guesses(
+        ['show.s01e01.mkv', 'show.s01e02.mkv'],
+        [get_plugin('guess', get_guess=guess_episode,
+                    get_guesses=get_guesses)])
+
+    assert [guess['episode'] for guess in guesses] == [1, 2]
+
+
+def test_sort_many_keeps_sorting_after_a_failed_guess(stored):
+    def get_guess(filepath):
+        if 'broken' in filepath:
+            raise ValueError("broken")
+        return guess_episode(filepath)
+
+    plugins = get_plugins(get_plugin(
+        'tmdb', get_identificator=lambda *args: {'tmdb': 1}))
+    plugins['guess'] = [get_plugin('guess', get_guess=get_guess)]
+
+    results = sorting.sort_many(['broken.s01e01.mkv', 'show.s01e01.mkv'],
+                                plugins, IDS, None, None, SETTINGS)
+
+    assert isinstance(results[0]['error'], ValueError)
+    assert results[1]['success']
+
+
+# GROUPS
+def identify_at_once(names, identificator, groups):
+    """ identifies the guesses of many names at the same time """
+    barrier = threading.Barrier(len(names))
+    plugins = get_plugins(identificator)
+
+    def identify(name):
+        barrier.wait()
+        return sorting.get_grouped_identificator(
+            guess_episode(name), plugins['identificator'], IDS, None, groups)
+
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        return list(executor.map(identify, names))
+
+
+def test_group_is_identified_once():
+    calls = []
+
+    def get_identificator(guess, identificator, callback):
+        calls.append(guess['title'])
+        time.sleep(0.01)
+        return {'tmdb': 1}
+
+    names = ['show.s01e{0:02}.mkv'.format(i) for i in range(1, 9)]
+    identificators = identify_at_once(
+        names, get_plugin('tmdb', get_identificator=get_identificator),
+        sorting.get_group_registry())
+
+    assert calls == ['show']
+    # every episode gets its own copy with its own values
+    assert [i['episode'] for i in identificators] == list(range(1, 9))
+    assert all(i['tmdb'] == 1 for i in identificators)
+
+
+def test_every_group_is_identified():
+    calls = []
+
+    def get_identificator(guess, identificator, callback):
+        calls.append(guess['title'])
+        return {'tmdb': len(guess['title'])}
+
+    identificators = identify_at_once(
+        ['show.s01e01.mkv', 'other.s01e01.mkv', 'show.s01e02.mkv'],
+        get_plugin('tmdb', get_identificator=get_identificator),
+        sorting.get_group_registry())
+
+    assert sorted(calls) == ['other', 'show']
+    assert [i['tmdb'] for i in identificators] == [4, 5, 4]
+
+
+def test_failed_group_is_tried_again():
+    calls = []
+
+    def get_identificator(guess, identificator, callback):
+        calls.append(guess['episode'])
+        if len(calls) == 1:
+            raise error.CallbackBreak("Try later")
+        return {'tmdb': 1}
+
+    plugins = get_plugins(get_plugin('tmdb',
+                                     get_identificator=get_identificator))
+    groups = sorting.get_group_registry()
+
+    def identify(name):
+        return sorting.get_grouped_identificator(
+            guess_episode(name), plugins['identificator'], IDS, None, groups)
+
+    with pytest.raises(error.CallbackBreak):
+        identify('show.s01e01.mkv')
+    assert identify('show.s01e02.mkv')['tmdb'] == 1
+    assert identify('show.s01e03.mkv')['tmdb'] == 1
+    assert calls == [1, 2]
+
+
+def test_videofile_with_nfo_is_identified_alone(tmp_path):
+    calls = []
+
+    def get_identificator(guess, identificator, callback):
+        calls.append(guess['episode'])
+        return {'tmdb': 1}
+
+    (tmp_path / 'show.s01e02.nfo').write_text('<episodedetails/>')
+    plugins = get_plugins(get_plugin('tmdb',
+                                     get_identificator=get_identificator))
+    groups = sorting.get_group_registry()
+
+    for name in ['show.s01e01.mkv', 'show.s01e02.mkv', 'show.s01e03.mkv']:
+        sorting.get_grouped_identificator(
+            guess_episode(str(tmp_path / name)), plugins['identificator'],
+            IDS, None, groups)
+
+    assert calls == [1, 2]
@@ -0,0 +1,95 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" tests of the requests of tmdb """
+
+import asyncio
+
+import pytest
+
+from mediasort import error
+from mediasort.plugins import tmdb
+
+IDENTIFICATOR = {'tmdb': 1, 'season': 1, 'episode': 3}
+
+
+def get_season(episodes):
+    return {'episodes': [{'episode_number': number}
+                         for number in range(1, episodes + 1)]}
+
+
+@pytest.fixture
+def seasons(monkeypatch):
+    """ tmdb answers with a season which gets a new episode after every
+    request. returns the number of requests """
+    requests = []
+
+    class Season:
+        def __init__(self, *args):
+            pass
+
+        def info(self, **params):
+            requests.append(params)
+            return get_season(len(requests) + 1)
+
+    async def get_json_async(url, params=None):
+        return Season().info(**params)
+
+    endpoints = dict(tmdb.ENDPOINTS)
+    endpoints['season'] = (Season,) + endpoints['season'][1:]
+    monkeypatch.setattr(tmdb, 'ENDPOINTS', endpoints)
+    monkeypatch.setattr(tmdb.httpclient, 'get_json_async', get_json_async)
+    monkeypatch.setattr(tmdb, 'CONFIG', {'responses': {
+        'enabled': True, 'ttl': tmdb.RESPONSE_TTL, 'size': 1}})
+    tmdb.clear_cache()
+    yield requests
+    tmdb.clear_cache()
+
+
+def test_cached_season_is_used(seasons):
+    tmdb.get_episode(dict(IDENTIFICATOR, episode=1), 'en')
+    tmdb.get_episode(dict(IDENTIFICATOR, episode=2), 'en')
+
+    assert len(seasons) == 1
+
+
+def test_missing_episode_reloads_the_season(seasons):
+    tmdb.get_episode(dict(IDENTIFICATOR, episode=1), 'en')
+    # neither memory nor the persistent cache hide the new episode
+    tmdb.clear_cache()
+    assert tmdb.get_episode(IDENTIFICATOR, 'en')['episode_number'] == 3
+    assert len(seasons) == 2
+
+    # the reloaded season is cached
+    tmdb.get_episode(IDENTIFICATOR, 'en')
+    assert len(seasons) == 2
+
+
+def test_season_is_reloaded_only_once(seasons):
+    with pytest.raises(error.NotEnoughData):
+        tmdb.get_episode(dict(IDENTIFICATOR, episode=4), 'en')
+
+    assert len(seasons) == 2
+
+
+def test_missing_episode_reloads_the_season_async(seasons):
+    tmdb.get_episode(dict(IDENTIFICATOR, episode=1), 'en')
+
+    episode = asyncio.run(tmdb.run_async(tmdb.get_episode, IDENTIFICATOR,
+                                         'en'))
+
+    assert episode['episode_number'] == 3
+    assert len(seasons) == 2
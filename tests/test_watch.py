@@ -0,0 +1,68 @@
+# Copyright (C) 2016-2017  Oboe, Chris <chrisoboe@eml.cc>
+# Author: Oboe, Chris <chrisoboe@eml.cc>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+""" tests of the watch mode """
+
+import queue
+import threading
+import types
+
+import pytest
+
+from mediasort import download, sorting, watch
+
+
+@pytest.fixture
+def watched(tmp_path, monkeypatch):
+    """ watches a folder with a plugin counting how often its cache was
+    cleared. yields the folder, the sorted results and the plugin """
+    results = queue.Queue()
+    plugin = types.ModuleType('mediasort.plugins.counting')
+    plugin.cleared = 0
+
+    def clear_cache():
+        plugin.cleared += 1
+    plugin.clear_cache = clear_cache
+
+    def sort(filepath, *args, **kwargs):
+        return sorting.get_result(filepath)
+    monkeypatch.setattr(sorting, 'sort', sort)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=watch.watch, kwargs={
+        'roots': [str(tmp_path)], 'extensions': ['mkv'], 'filesize': 0,
+        'plugins': {'guess': [plugin]}, 'ids': None, 'paths': None,
+        'languages': None, 'settings': {},
+        'callbacks': {'result': results.put}, 'settle': 0.0, 'stop': stop})
+    thread.start()
+    yield tmp_path, results, plugin
+    stop.set()
+    thread.join()
+
+
+def test_every_batch_starts_with_empty_caches(watched):
+    folder, results, plugin = watched
+    download.DOWNLOADED.append('/media/poster')
+
+    (folder / 'a.mkv').write_bytes(b'video')
+    results.get(timeout=10)
+    assert plugin.cleared == 1
+    assert download.DOWNLOADED == []
+
+    (folder / 'b.mkv').write_bytes(b'video')
+    results.get(timeout=10)
+    assert plugin.cleared == 2